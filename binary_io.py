@@ -1,6 +1,150 @@
+import io
 import struct 
 
 
+_uint32 = struct.Struct(">I")
+_uint16 = struct.Struct(">H")
+_int16 = struct.Struct(">h")
+_uint8 = struct.Struct(">B")
+_int8 = struct.Struct(">b")
+_float = struct.Struct(">f")
+
+
+# File-like reader over an in-memory buffer (bytes, bytearray, memoryview, mmap or io.BytesIO).
+# It supports the read/seek/tell/peek calls the section parsers use, but the read helpers below
+# decode straight out of the buffer with unpack_from instead of going through file calls.
+class BufferReader(object):
+    def __init__(self, data, offset=0):
+        if isinstance(data, io.BytesIO):
+            data = data.getbuffer()
+        self.buffer = memoryview(data).cast("B")
+        self.size = len(self.buffer)
+        self.pos = offset
+
+    def read(self, size=-1):
+        start = self.pos
+        if size is None or size < 0:
+            end = self.size
+        else:
+            end = min(start + size, self.size)
+        self.pos = end
+        return bytes(self.buffer[start:end])
+
+    def peek(self, size=1):
+        return bytes(self.buffer[self.pos:self.pos+max(size, 1)])
+
+    # Slice of the buffer without copying, it keeps the whole buffer alive
+    def view(self, offset, size):
+        return self.buffer[offset:offset+size]
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position {0}".format(offset))
+        self.pos = offset
+        return offset
+
+    def tell(self):
+        return self.pos
+
+    def unpack(self, fmt):
+        values = fmt.unpack_from(self.buffer, self.pos)
+        self.pos += fmt.size
+        return values
+
+    def unpack_at(self, fmt, offset):
+        self.pos = offset + fmt.size
+        return fmt.unpack_from(self.buffer, offset)
+
+
+# File-like writer building the output in one preallocated bytearray that grows as needed.
+# Placeholders can be filled in afterwards with pack_into (see patch_struct) instead of seeking around,
+# and the finished data is handed to the real stream with a single write.
+class BufferWriter(object):
+    def __init__(self, capacity=0x10000):
+        self.buffer = bytearray(capacity)
+        self.size = 0
+        self.pos = 0
+
+    def _reserve(self, end):
+        if end > len(self.buffer):
+            self.buffer.extend(bytes(max(end - len(self.buffer), len(self.buffer))))
+
+    def write(self, data):
+        end = self.pos + len(data)
+        self._reserve(end)
+        self.buffer[self.pos:end] = data
+        self.pos = end
+        if end > self.size:
+            self.size = end
+        return len(data)
+
+    def pack(self, fmt, *values):
+        end = self.pos + fmt.size
+        self._reserve(end)
+        fmt.pack_into(self.buffer, self.pos, *values)
+        self.pos = end
+        if end > self.size:
+            self.size = end
+
+    def pack_into(self, fmt, offset, *values):
+        assert offset + fmt.size <= self.size
+        fmt.pack_into(self.buffer, offset, *values)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position {0}".format(offset))
+        self.pos = offset
+        return offset
+
+    def tell(self):
+        return self.pos
+
+    def getbuffer(self):
+        return memoryview(self.buffer)[:self.size]
+
+    def getvalue(self):
+        return bytes(self.buffer[:self.size])
+
+    # Write everything to a real stream in one call
+    def flush_to(self, f):
+        with self.getbuffer() as data:
+            f.write(data)
+
+
+# Decode a precompiled struct.Struct at the current position of f
+def read_struct(f, fmt):
+    if isinstance(f, BufferReader):
+        return f.unpack(fmt)
+    return fmt.unpack(f.read(fmt.size))
+
+
+# Encode values with a precompiled struct.Struct at the current position of f
+def write_struct(f, fmt, *values):
+    if isinstance(f, BufferWriter):
+        f.pack(fmt, *values)
+    else:
+        f.write(fmt.pack(*values))
+
+
+# Overwrite earlier written data at offset without moving the current position
+def patch_struct(f, fmt, offset, *values):
+    if isinstance(f, BufferWriter):
+        f.pack_into(fmt, offset, *values)
+    else:
+        curr = f.tell()
+        f.seek(offset)
+        f.write(fmt.pack(*values))
+        f.seek(curr)
+
+
 def read_name(f):
     return str(f.read(4), "ascii")
 
@@ -12,38 +156,44 @@ def write_name(f, name):
 
 
 def read_uint32(f):
-    return struct.unpack(">I", f.read(4))[0]
+    return read_struct(f, _uint32)[0]
 
 
 def read_uint16(f):
-    return struct.unpack(">H", f.read(2))[0]
+    return read_struct(f, _uint16)[0]
     
     
 def read_int16(f):
-    return struct.unpack(">h", f.read(2))[0]
+    return read_struct(f, _int16)[0]
 
 
 def read_int16_at(f, offset):
+    if isinstance(f, BufferReader):
+        return f.unpack_at(_int16, offset)[0]
     f.seek(offset)
-    return struct.unpack(">h", f.read(2))[0]
+    return _int16.unpack(f.read(2))[0]
 
     
 def read_uint8(f):
-    return struct.unpack(">B", f.read(1))[0]
+    return read_struct(f, _uint8)[0]
 
     
 def read_uint8_at(f, offset):
+    if isinstance(f, BufferReader):
+        return f.unpack_at(_uint8, offset)[0]
     f.seek(offset)
-    return struct.unpack(">B", f.read(1))[0]
+    return _uint8.unpack(f.read(1))[0]
     
     
 def read_int8_at(f, offset):
+    if isinstance(f, BufferReader):
+        return f.unpack_at(_int8, offset)[0]
     f.seek(offset)
-    return struct.unpack(">b", f.read(1))[0]
+    return _int8.unpack(f.read(1))[0]
 
 
 def read_float(f):
-    return struct.unpack(">f", f.read(4))[0]
+    return read_struct(f, _float)[0]
 
 
 def peek_id(f):
@@ -52,45 +202,49 @@ def peek_id(f):
     
     
 def write_uint32(f, val):
-    f.write(struct.pack(">I", val))
+    f.write(_uint32.pack(val))
     
     
 def write_uint16(f, val):
-    f.write(struct.pack(">H", val))
+    f.write(_uint16.pack(val))
 
 
 def write_int16(f, val):
-    f.write(struct.pack(">h", val))
+    f.write(_int16.pack(val))
 
 
 def write_uint8(f, val):
-    f.write(struct.pack(">B", val))
+    f.write(_uint8.pack(val))
 
 
 def write_int8(f, val):
-    f.write(struct.pack(">b", val))
+    f.write(_int8.pack(val))
 
 
 def write_int16_at(f, val, offset):
     f.seek(offset)
-    f.write(struct.pack(">h", val))
+    f.write(_int16.pack(val))
 
 
 def write_int8_at(f, val, offset):
     f.seek(offset)
-    f.write(struct.pack(">b", val))
+    f.write(_int8.pack(val))
 
     
 def write_float(f, val):
-    f.write(struct.pack(">f", val))
+    f.write(_float.pack(val))
 
 
 padding_msg = b"This is padding data to align"
 
 
+def get_padding(size):
+    return (padding_msg * (size // len(padding_msg) + 1))[:size]
+
+
 def write_pad(f, multiple):
     next_aligned_pos = (f.tell() + (multiple-1)) & ~(multiple-1)
 
-    for i in range(next_aligned_pos - f.tell()):
-        f.write(padding_msg[i%len(padding_msg):i%len(padding_msg)+1])
+    if next_aligned_pos > f.tell():
+        f.write(get_padding(next_aligned_pos - f.tell()))
     #f.write(b"\x00"*(next_aligned_pos - f.tell()))
@@ -0,0 +1,123 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from binary_io import *
+from readblo2 import ScreenBlo, FILE_HEADER_STRUCT
+
+
+# Extract the text of every TBX2 section of a set of .blo files into one table and inject changed
+# texts back. Each row of the table is a dict:
+#   {"file": path, "section": index in ScreenBlo.scan_sections, "pane": p_panename,
+#    "text_cutoff": text_cutoff, "text": text}
+# On injection only the TBX2 sections whose text or text_cutoff changed are encoded again,
+# every other byte of the file is copied through.
+
+def extract_file(path):
+    with open(path, "rb") as f:
+        f = BufferReader(f.read())
+
+    sections = ScreenBlo.scan_sections(f)
+    f.seek(0)
+
+    rows = []
+    for i, section in enumerate(sections):
+        if section.magic == "TBX2":
+            textbox = ScreenBlo.read_section(f, section)
+            rows.append({"file": path, "section": i, "pane": section.panename,
+                         "text_cutoff": textbox.text_cutoff, "text": textbox.text})
+
+    return rows
+
+
+# Replace the texts of the file with the ones in rows, writing the result to outpath (by default
+# the file itself). Returns the number of changed textboxes, the file isn't written if there are none.
+def inject_file(path, rows, outpath=None):
+    with open(path, "rb") as f:
+        data = f.read()
+    f = BufferReader(data)
+    sections = ScreenBlo.scan_sections(f)
+    f.seek(0)
+
+    replaced = {}
+    for row in rows:
+        section = sections[row["section"]] if row["section"] < len(sections) else None
+        if section is None or section.magic != "TBX2" or section.panename != row["pane"]:
+            raise RuntimeError("Section {0} of {1} is not the textbox {2}, was the file changed since extracting?".format(
+                row["section"], path, row["pane"]))
+
+        textbox = ScreenBlo.read_section(f, section)
+        if textbox.text != row["text"] or textbox.text_cutoff != row["text_cutoff"]:
+            textbox.text = row["text"]
+            textbox.text_cutoff = row["text_cutoff"]
+            # Sections start 8 byte aligned so the text padding is the same as at the section's offset
+            out = BufferWriter(section.size * 2)
+            textbox.write(out, None)
+            replaced[row["section"]] = out.getvalue()
+
+    if not replaced:
+        return 0
+
+    out = BufferWriter(len(data) * 2)
+    pos = 0
+    for i in sorted(replaced):
+        out.write(data[pos:sections[i].offset])
+        out.write(replaced[i])
+        pos = sections[i].offset + sections[i].size
+
+    end = sections[-1].offset + sections[-1].size  # End of the EXT1 section, followed by padding
+    out.write(data[pos:end])
+    write_pad(out, 0x20)
+
+    magic, size, count = FILE_HEADER_STRUCT.unpack_from(data, 0)
+    patch_struct(out, FILE_HEADER_STRUCT, 0, magic, out.tell(), count)
+
+    if outpath is None:
+        outpath = path
+    tmp_path = outpath + ".tmp"
+    with open(tmp_path, "wb") as f:
+        out.flush_to(f)
+    os.replace(tmp_path, outpath)
+
+    return len(replaced)
+
+
+# Extract the texts of all files, in parallel with up to jobs processes (default: one per CPU)
+def extract_corpus(paths, jobs=None):
+    rows = []
+    with ProcessPoolExecutor(jobs) as executor:
+        for result in executor.map(extract_file, paths):
+            rows.extend(result)
+
+    return rows
+
+
+# Inject a table made with extract_corpus back into its files in place.
+# Returns a dict from each file to the number of changed textboxes.
+def inject_corpus(rows, jobs=None):
+    files = {}
+    for row in rows:
+        files.setdefault(row["file"], []).append(row)
+
+    with ProcessPoolExecutor(jobs) as executor:
+        return dict(zip(files, executor.map(inject_file, files, files.values())))
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 3 or sys.argv[1] not in ("extract", "inject"):
+        print("Usage: localizeblo2.py extract table.json file.blo [file.blo ...]")
+        print("       localizeblo2.py inject table.json")
+        sys.exit(1)
+
+    tablefile = sys.argv[2]
+    if sys.argv[1] == "extract":
+        rows = extract_corpus(sys.argv[3:])
+        with open(tablefile, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=4, ensure_ascii=False)
+        print("{0} texts extracted".format(len(rows)))
+    else:
+        with open(tablefile, "r", encoding="utf-8") as f:
+            rows = json.load(f)
+        for path, count in inject_corpus(rows).items():
+            if count > 0:
+                print("{0}: {1} text(s) changed".format(path, count))
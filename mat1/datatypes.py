@@ -1,10 +1,13 @@
 from binascii import hexlify, unhexlify
+from copy import copy as copy_object
 from binary_io import *
 
 from .enums import *
 
 
 class Color(object):
+    __slots__ = ("r", "g", "b", "a")
+
     def __init__(self, r, g, b, a):
         self.r = r
         self.g = g
@@ -36,9 +39,17 @@ class Color(object):
         color = cls(*obj)
         return color
 
+    def copy(self):
+        return Color(self.r, self.g, self.b, self.a)
+
     def __eq__(self, other):
+        if self is other:
+            return True
         return self.r == other.r and self.g == other.g and self.b == other.b and self.a == other.a
 
+    def __hash__(self):
+        return hash((self.r, self.g, self.b, self.a))
+
 """
 class ChannelControl(object):
     def __init__(self):
@@ -86,15 +97,32 @@ class ChannelControl(object):
 
 class UnknownData(object):
     size = 0
+    _hex = None  # Hex string of data, made on the first serialize
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "_kind" not in cls.__dict__:
+            cls._kind = cls  # The class values are compared by, shared with the frozen class of InternPool
 
     def __init__(self, index=None):
-        self.data = b""
+        self._data = b""
         self.index = index
 
+    # The record bytes. Parsed with ParseOptions.zero_copy this is a memoryview into the file buffer
+    # until a new value is set.
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self.__dict__.pop("_hex", None)
+
     @classmethod
     def from_file(cls, f, index=None):
         obj = cls(index)
-        obj.data = f.read(cls.size)
+        obj._data = f.read(cls.size)
         return obj
 
     @classmethod
@@ -105,15 +133,29 @@ class UnknownData(object):
         else:
             return cls.from_file(f)
 
+    # Use a buffer slice of the record as data without copying it
+    @classmethod
+    def from_view(cls, view, index=None):
+        obj = cls(index)
+        obj._data = view
+        return obj
+
+    def copy(self):
+        obj = object.__new__(type(self))
+        obj.__dict__.update(self.__dict__)
+        return obj
+
     def write(self, f):
-        assert len(self.data) == self.size
-        f.write(self.data)
+        assert len(self._data) == self.size
+        f.write(self._data)
 
     def serialize(self):
+        if self._hex is None:
+            self.__dict__["_hex"] = str(hexlify(self._data), encoding="ascii")
         if self.index is None:
-            return str(hexlify(self.data), encoding="ascii")
+            return self._hex
         else:
-            return "i={0};".format(self.index)+str(hexlify(self.data), encoding="ascii")
+            return "i={0};".format(self.index)+self._hex
         
 
     @classmethod
@@ -123,8 +165,6 @@ class UnknownData(object):
             end = obj.find(";")
             index = int(obj[start:end])
             obj = obj[end+1:]
-            print(obj)
-            print("Detected index", index, obj)
             unkobj = cls(index)
         else:
             unkobj = cls()
@@ -135,8 +175,25 @@ class UnknownData(object):
 
     def __eq__(self, other):
         #print(self, other)
-        assert type(self) == type(other)
-        return self.data == other.data and self.index == other.index
+        if self is other:
+            return True
+        assert self._kind is other._kind
+        return self._data == other._data and self.index == other.index
+
+    def __hash__(self):
+        data = self._data
+        if isinstance(data, memoryview) and not data.readonly:
+            data = bytes(data)  # Views of writable buffers can't be hashed
+        return hash((self._kind, data, self.index))
+
+    # Views can't be pickled or copied, the bytes are copied instead
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_data"] = bytes(self._data)
+        return state
+
+
+UnknownData._kind = UnknownData
 
 
 class ChannelControl(UnknownData):
@@ -202,3 +259,162 @@ class FontNumber(UnknownData):
 
 class IndirectInitData(UnknownData):
     size = 0x128  # All indirect data
+
+
+# List that calls owner.mark_dirty() when it is changed in place. Items with an owner of their own
+# (an _owner attribute, e.g. window subdata) get the list's owner when they are added.
+class OwnedList(list):
+    __slots__ = ("_owner", )
+
+    def __init__(self, items=(), owner=None):
+        list.__init__(self, items)
+        self._owner = owner
+
+    def _changed(self, items=()):
+        owner = getattr(self, "_owner", None)  # Not set yet while unpickling
+        if owner is None:
+            return
+        owner.mark_dirty()
+        for item in items:
+            if hasattr(item, "_owner") and not is_frozen(item):
+                object.__setattr__(item, "_owner", owner)
+
+    def __setitem__(self, i, value):
+        if isinstance(i, slice):
+            value = list(value)
+        list.__setitem__(self, i, value)
+        self._changed(value if isinstance(i, slice) else (value, ))
+
+    def __delitem__(self, i):
+        list.__delitem__(self, i)
+        self._changed()
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def __imul__(self, count):
+        list.__imul__(self, count)
+        self._changed()
+        return self
+
+    def append(self, value):
+        list.append(self, value)
+        self._changed((value, ))
+
+    def extend(self, items):
+        items = list(items)
+        list.extend(self, items)
+        self._changed(items)
+
+    def insert(self, i, value):
+        list.insert(self, i, value)
+        self._changed((value, ))
+
+    def pop(self, i=-1):
+        value = list.pop(self, i)
+        self._changed()
+        return value
+
+    def remove(self, value):
+        list.remove(self, value)
+        self._changed()
+
+    def clear(self):
+        list.clear(self)
+        self._changed()
+
+    def sort(self, *args, **kwargs):
+        list.sort(self, *args, **kwargs)
+        self._changed()
+
+    def reverse(self):
+        list.reverse(self)
+        self._changed()
+
+
+def _frozen_setattr(self, name, value):
+    raise AttributeError("{0} is frozen and can't be modified, modify a copy (copy.copy) "
+                         "or replace it with a new instance instead".format(type(self).__name__))
+
+
+# Attributes of obj in its __dict__ and in the __slots__ of its classes, as two dicts
+def _instance_state(obj):
+    state = dict(getattr(obj, "__dict__", {}))
+    slots = {}
+    for cls in type(obj).__mro__:
+        for name in cls.__dict__.get("__slots__", ()):
+            if hasattr(obj, name):
+                slots[name] = getattr(obj, name)
+    return state, slots
+
+
+# Frozen instances are pickled and copied as regular, unshared instances of the original class.
+# The attributes are restored after the instance exists so references back to it (e.g. between panes)
+# are resolved by pickle. Slots are set with setattr, public ones first because setting those can
+# reset private ones like a modified flag.
+def _frozen_reduce_ex(self, protocol):
+    state, slots = _instance_state(self)
+    slots = dict(sorted(slots.items(), key=lambda item: item[0][0] == "_"))
+    return _unfrozen, (type(self).__base__, ), (state or None, slots)
+
+
+def _unfrozen(cls):
+    return cls.__new__(cls)
+
+
+_frozen_classes = {}  # Class -> its frozen subclass
+_frozen_types = set()
+
+
+def frozen_class(cls):
+    if cls not in _frozen_classes:
+        _frozen_classes[cls] = type(cls.__name__, (cls, ), {
+            "__slots__": (), "__setattr__": _frozen_setattr, "__delattr__": _frozen_setattr,
+            "__reduce_ex__": _frozen_reduce_ex, "_kind": getattr(cls, "_kind", cls), "__module__": cls.__module__})
+        _frozen_types.add(_frozen_classes[cls])
+    return _frozen_classes[cls]
+
+
+# Whether obj was frozen by an InternPool or ScreenBlo.freeze
+def is_frozen(obj):
+    return type(obj) in _frozen_types
+
+
+# Shallow copy of obj as an instance of its frozen class, see ScreenBlo.freeze. The copy's attributes
+# can still be replaced with object.__setattr__ until it is shared.
+def frozen_copy(obj):
+    copy = object.__new__(frozen_class(type(obj)))
+    state, slots = _instance_state(obj)
+    for name, value in list(state.items()) + list(slots.items()):
+        object.__setattr__(copy, name, value)
+    return copy
+
+
+# Keeps one shared instance per distinct value of the material sub-records (UnknownData), enums and
+# colors, see ParseOptions.pool. Use one pool per file, or share it between all files of a session.
+# Shared instances are frozen: setting an attribute raises an AttributeError, replace them with a
+# new instance instead. They still compare equal to unshared instances with the same value.
+class InternPool(object):
+    def __init__(self):
+        self.instances = {}  # (class, instance) -> shared instance
+
+    # Returns the shared instance with the value of obj. If there is none yet obj becomes the shared
+    # instance, or a copy of it with copy so obj itself stays modifiable.
+    def intern(self, obj, copy=False):
+        if obj is None or type(obj) in _frozen_types:
+            return obj
+
+        cls = type(obj)
+        shared = self.instances.get((cls, obj))
+        if shared is None:
+            shared = copy_object(obj) if copy else obj
+            if isinstance(shared, UnknownData) and isinstance(shared.data, memoryview):
+                shared.data = bytes(shared.data)  # Don't keep the whole file buffer alive for the whole session
+            shared.__class__ = frozen_class(cls)
+            self.instances[(cls, shared)] = shared
+        return shared
+
+    def __len__(self):
+        return len(self.instances)
+
@@ -4,10 +4,22 @@ from binary_io import *
 
 class GXEnum(object):
     enum = IntEnum("PlaceHolder", ["NONE"], start=0)
+    members = {str(enum.NONE): enum.NONE}  # Serialized name -> enum member, for every subclass
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.members = {str(member): member for member in cls.enum}
+        if "_kind" not in cls.__dict__:
+            cls._kind = cls  # The class values are compared by, shared with the frozen class of InternPool
 
     def __init__(self, value=0):
         self.value = self.enum(value)
 
+    def copy(self):
+        obj = object.__new__(type(self))
+        obj.value = self.value
+        return obj
+
     @classmethod
     def from_array(cls, f, start, i):
         f.seek(start + i)
@@ -28,16 +40,24 @@ class GXEnum(object):
 
     @classmethod
     def deserialize(cls, obj):
-        for member in cls.enum:
-            if str(member) == obj:
-                setting = cls()
-                setting.value = member
-                return setting
+        member = cls.members.get(obj)
+        if member is None:
+            raise RuntimeError("Not a member of this enum: {0}".format(obj))
 
-        raise RuntimeError("Not a member of this enum: {0}".format(obj))
+        setting = cls()
+        setting.value = member
+        return setting
 
     def __eq__(self, other):
-        return type(self) == type(other) and self.value == other.value
+        if self is other:
+            return True
+        return self._kind is getattr(other, "_kind", None) and self.value == other.value
+
+    def __hash__(self):
+        return hash((self._kind, int(self.value)))
+
+
+GXEnum._kind = GXEnum
 
 
 class GXEnum_4_byte(GXEnum):
@@ -1,7 +1,14 @@
 import struct
 from binascii import hexlify
+from collections.abc import MutableSequence
+
+try:
+    import numpy
+except ImportError:  # Only needed for the "numpy" MAT1 engine
+    numpy = None
 
 from binary_io import *
+from parse_options import ParseOptions
 from .enums import *
 from .datatypes import *
 
@@ -19,31 +26,27 @@ class StringTable(object):
         string_count = read_uint16(f)
         f.read(2) # 0xFFFF
         
-        offsets = []
-        
-        for i in range(string_count):
-            hash = read_uint16(f)
-            string_offset = read_uint16(f)
-            
-            offsets.append(string_offset)
-        
+        # Entries are (hash, offset) pairs, we only need the offsets
+        offsets = struct.unpack(">{0}H".format(string_count*2), f.read(string_count*4))[1::2]
+        if string_count == 0:
+            return stringtable
+
+        # Read the whole table in one go. The end of the table isn't stored, so read up to the
+        # furthest string and keep extending until its 0-terminator shows up.
+        last = max(offsets)
+        f.seek(start)
+        data = f.read(last + 0x20)
+        while data.find(b"\x00", last) == -1:
+            more = f.read(0x20)
+            if not more:
+                raise RuntimeError("String table is missing a string terminator")
+            data += more
+
         for offset in offsets:
-            f.seek(start+offset)
-            
-            # Read 0-terminated string 
-            string_start = f.tell()
-            string_length = 0
-            
-            while f.read(1) != b"\x00":
-                string_length += 1 
-            
-            f.seek(start+offset)
-            
-            if string_length == 0:
-                stringtable.strings.append("")
-            else:
-                stringtable.strings.append(f.read(string_length).decode("shift-jis"))
-            
+            end = data.find(b"\x00", offset)
+            stringtable.strings.append(data[offset:end].decode("shift-jis"))
+
+        f.seek(start + end + 1)
         return stringtable 
             
     def hash_string(self, string):
@@ -57,28 +60,18 @@ class StringTable(object):
         return hash
 
     def write(self, f):
-        start = f.tell()
-        f.write(struct.pack(">HH", len(self.strings), 0xFFFF))
-        
-        for string in self.strings:
-            hash = self.hash_string(string)
-            
-            f.write(struct.pack(">HH", hash, 0xABCD))
-        
-        offsets = []
-        
-        for string in self.strings:
-            offsets.append(f.tell())
-            f.write(string.encode("shift-jis"))
-            f.write(b"\x00")
-
-        end = f.tell()
+        encoded = [string.encode("shift-jis") for string in self.strings]
 
-        for i, offset in enumerate(offsets):
-            f.seek(start+4 + (i*4) + 2)
-            write_uint16(f, offset-start)
+        # Offsets are known from the encoded lengths, so the header can be written in one pass
+        header = [len(self.strings), 0xFFFF]
+        offset = 4 + len(self.strings)*4
+        for string, data in zip(self.strings, encoded):
+            header.append(self.hash_string(string))
+            header.append(offset)
+            offset += len(data) + 1
 
-        f.seek(end)
+        f.write(struct.pack(">{0}H".format(len(header)), *header))
+        f.write(b"".join(data + b"\x00" for data in encoded))
 
     def serialize(self):
         return self.strings
@@ -91,9 +84,44 @@ class StringTable(object):
         return stringtable
 
 
+# List of unique table entries for MAT1.write with a dict from entry to its first index,
+# so looking up an entry doesn't have to scan the list
+class DataArray(list):
+    def __init__(self, items=()):
+        super().__init__()
+        self.indices = {}
+        for item in items:
+            self.append(item)
+
+    def append(self, value):
+        self.indices.setdefault(value, len(self))
+        super().append(value)
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self.indices = {}
+        for i, value in enumerate(self):
+            self.indices.setdefault(value, i)
+
+    def __contains__(self, value):
+        return value in self.indices
+
+    def index(self, value):
+        return self.indices[value]
+
+    def index_or_add(self, value):
+        index = self.indices.get(value)
+        if index is None:
+            index = len(self)
+            self.append(value)
+        return index
+
+
 def get_index_or_add(array, value):
     if value is None:
         return -1
+    elif isinstance(array, DataArray):
+        return array.index_or_add(value)
     elif value in array:
         return array.index(value)
     else:
@@ -112,224 +140,421 @@ def deserialize_array(array, func):
     return result
 
 
-def read_index_array(f, offset, size, count):
-    values = []
-    read_at = None
-    if size == 1:
-        read_at = read_int8_at 
-    elif size == 2:
-        read_at = read_int16_at 
-    
-    for i in range(count):
-        value = read_at(f, offset + i*size)
-        values.append(value)
-    
-    return values
-
+index_array_formats = {}
 
-def write_index_array(f, array, offset, size, count):
-    assert len(array) == count
 
-    values = []
-    write_at = None
-    if size == 1:
-        write_at = write_int8_at
-    elif size == 2:
-        write_at = write_int16_at
+# Struct for a block of count signed 1 or 2 byte indices
+def get_index_array_format(size, count):
+    key = (size, count)
+    if key not in index_array_formats:
+        index_array_formats[key] = struct.Struct(">{0}{1}".format(count, "b" if size == 1 else "h"))
 
-    for i in range(count):
-        write_at(f, array[i], offset + i * size)
+    return index_array_formats[key]
+
+
+def write_index_block(f, array, size):
+    f.write(get_index_array_format(size, len(array)).pack(*array))
+
+
+# Layout of a 0xE8 byte Material Init Data entry: (field, signed type, count). Most fields are indices
+# into the MAT1 sub-tables, -1 meaning unused.
+MATERIAL_INIT_DATA_LAYOUT = (
+    ("flag", "b", 1), ("cullmode", "b", 1), ("color_channel_count", "b", 1), ("tex_gen_count", "b", 1),
+    ("tev_stage_count", "b", 1), ("dither", "b", 1), ("unk", "b", 1), ("padding", "b", 1),
+    ("matcolors", "h", 2), ("color_channels", "h", 4), ("tex_coord_generators", "h", 8),
+    ("tex_matrices", "h", 8), ("padding2", "h", 2), ("textures", "h", 8), ("font", "h", 1),
+    ("tevkcolors", "h", 4), ("tevkcolor_selects", "b", 16), ("tevkalpha_selects", "b", 16),
+    ("tevorders", "h", 16), ("tevcolors", "h", 4), ("tevstages", "h", 16), ("tevstage_swapmodes", "h", 16),
+    ("tev_swapmode_tables", "h", 4), ("alphacomp", "h", 1), ("blend", "h", 1), ("padding3", "h", 1))
+
+MATERIAL_INIT_DATA_STRUCT = struct.Struct(">" + "".join("{0}{1}".format(count, fmt)
+                                                         for name, fmt, count in MATERIAL_INIT_DATA_LAYOUT))
+assert MATERIAL_INIT_DATA_STRUCT.size == 0xE8
+
+if numpy is not None:
+    MATERIAL_INIT_DATA_DTYPE = numpy.dtype([
+        (name, ">i1" if fmt == "b" else ">i2") if count == 1 else (name, ">i1" if fmt == "b" else ">i2", (count,))
+        for name, fmt, count in MATERIAL_INIT_DATA_LAYOUT])
+    assert MATERIAL_INIT_DATA_DTYPE.itemsize == 0xE8
+
+# The MAT1 header has an offset for each of these tables, in this order
+MAT1_DATATYPES = (
+    "MaterialInitData", "MaterialIndexRemapTable", "MaterialNames", "IndirectInitData", "GXCullMode", "MaterialColor",
+    "UcArray2_ColorChannelCount", "ColorChannelInfo", "UcArray3_TexGenCount", "TexCoordInfo", "TexMatrixInfo",
+    "UsArray4_TextureIndices", "UsArray5", "TevOrderInfo", "GXColorS10_TevColor", "GXColor2_TevKColors",
+    "UCArray6_Tevstagenums", "TevStageInfo2", "TevSwapModeInfo", "TevSwapModeTableInfo", "AlphaCompInfo",
+    "BlendInfo", "UcArray7_Dither")
+
+MAT1_HEADER_STRUCT = struct.Struct(">4sIhH")
+MAT1_OFFSETS_STRUCT = struct.Struct(">{0}I".format(len(MAT1_DATATYPES)))
+
+
+# With ParseOptions.zero_copy only records of at least this size are kept as views, a memoryview object
+# takes about 0xB8 bytes which is more than a copy of the smaller records
+VIEW_MIN_SIZE = 0x100
+
+
+# Base of the sub-table lookups for MaterialInitData.from_record. With an InternPool (see ParseOptions.pool)
+# every entry is decoded only once per MAT1 and replaced with the pool's shared instance.
+# trace is the TraceContext of the parse, or None.
+class SubTables(object):
+    def __init__(self, offsets, views=False, pool=None, trace=None):
+        self.offsets = offsets
+        self.views = views
+        self.pool = pool
+        self.trace = trace
+        self.shared = {}  # (datatype, index, remember_index) -> pooled entry
+
+    def get(self, cls, datatype, index, remember_index=False):
+        if self.pool is None:
+            return self.decode(cls, datatype, index, remember_index)
+
+        key = (datatype, index, remember_index)
+        obj = self.shared.get(key)
+        if obj is None:
+            obj = self.shared[key] = self.pool.intern(self.decode(cls, datatype, index, remember_index))
+        return obj
+
+
+# Sub-table lookups reading each entry from the file when it is needed
+class MaterialTables(SubTables):
+    def __init__(self, f, offsets, views=False, pool=None, trace=None):
+        super().__init__(offsets, views, pool, trace)
+        self.f = f  # Has to be a BufferReader with views, UnknownData entries are views into it
+
+    def decode(self, cls, datatype, index, remember_index=False):
+        if self.views and issubclass(cls, UnknownData) and cls.size >= VIEW_MIN_SIZE:
+            view = self.f.view(self.offsets[datatype] + index*cls.size, cls.size)
+            return cls.from_view(view, index if remember_index else None)
+        if remember_index:
+            return cls.from_array(self.f, self.offsets[datatype], index, True)
+        return cls.from_array(self.f, self.offsets[datatype], index)
+
+    def get_uint8(self, datatype, index):
+        return read_uint8_at(self.f, self.offsets[datatype] + index)
+
+    def get_int16(self, datatype, index):
+        return read_int16_at(self.f, self.offsets[datatype] + index*2)
+
+
+# Sub-table lookups for MaterialInitData.from_columns backed by numpy arrays over the whole MAT1 section.
+# Every sub-table is mapped with a single frombuffer call and entries are built from the decoded rows.
+class NumpyMaterialTables(SubTables):
+    def __init__(self, data, start, offsets, views=False, pool=None, trace=None):
+        super().__init__(offsets, views, pool, trace)
+        self.data = data  # Has to be a memoryview with views, UnknownData entries are slices of it
+        self.tables = {}
+
+        # Sub-tables don't store their length, each one runs up to the next table or the end of the section
+        self.bounds = {}
+        table_starts = sorted(set(offset - start for offset in offsets.values() if offset > start))
+        for datatype, offset in offsets.items():
+            if offset <= start:
+                continue
+            table_start = offset - start
+            following = [x for x in table_starts if x > table_start]
+            self.bounds[datatype] = (table_start, following[0] if following else len(data))
+
+    def _table(self, datatype, dtype):
+        if datatype not in self.tables:
+            dtype = numpy.dtype(dtype)
+            table_start, table_end = self.bounds[datatype]
+            count = (table_end - table_start) // dtype.itemsize
+            self.tables[datatype] = numpy.frombuffer(self.data, dtype, count, table_start).tolist()
+
+        return self.tables[datatype]
+
+    def decode(self, cls, datatype, index, remember_index=False):
+        if issubclass(cls, UnknownData):
+            if self.views and cls.size >= VIEW_MIN_SIZE:
+                table_start = self.bounds[datatype][0] + index*cls.size
+                return cls.from_view(self.data[table_start:table_start + cls.size], index if remember_index else None)
+            obj = cls(index if remember_index else None)
+            obj.data = self._table(datatype, (numpy.void, cls.size))[index]
+            return obj
+        elif issubclass(cls, GXEnum_4_byte):
+            return cls(self._table(datatype, ">u4")[index])
+        elif issubclass(cls, GXEnum):
+            return cls(self._table(datatype, "u1")[index])
+        elif cls is Color:
+            return Color(*self._table(datatype, ("u1", 4))[index])
+        else:
+            raise RuntimeError("No numpy decoding for {0}".format(cls.__name__))
 
+    def get_uint8(self, datatype, index):
+        return self._table(datatype, "u1")[index]
 
-class DebugFileInfo(object):
-    def __init__(self, outpath):
-        self.path = outpath
-        #with open(outpath, "w") as f:
-        #    f.write("")
-        self.lines = []
-    
-    def add_line(self, data):
-        self.lines.append(data)
-    
-    def add_offset(self, name, offset, *args):
-        more = ""
-        for v in args:
-            more += str(v)+" "
-        self.lines.append("{}: 0x{:x}".format(name, offset)+" "+more)
-    
-    def write(self):
-        #with open(self.path, "a") as f:
-        #    for line in self.lines:
-        #        f.write(line)
-        #        f.write("\n")
-        pass
+    def get_int16(self, datatype, index):
+        return self._table(datatype, ">i2")[index]
 
+    # Decode count Material Init Data entries with one frombuffer, returning a dict from each field
+    # to its value in every entry
+    def read_columns(self, count):
+        table_start = self.bounds["MaterialInitData"][0]
+        records = numpy.frombuffer(self.data, MATERIAL_INIT_DATA_DTYPE, count, table_start)
+        return {name: records[name].tolist() for name, fmt, size in MATERIAL_INIT_DATA_LAYOUT}
 
-debug = DebugFileInfo("debug.txt")
+    # The entries of a sub-table at the indices in used, decoded once each. -1 (unused) maps to None.
+    def entries(self, cls, datatype, used, remember_index=False):
+        entries = {index: self.get(cls, datatype, index, remember_index) for index in used if index != -1}
+        entries[-1] = None
+        return entries
 
 
 class MaterialInitData(object):
+    _dirty = True  # Whether the material was modified since it was parsed
+
     def __init__(self):
         self.name = ""
-        
-    @classmethod
-    def from_array(cls, f, start, i, offsets, real_i):
-        initdata = cls()
-        #start = f.tell()
-        
-        f.seek(start + i * 0xE8) # 0xE8 is size of Material Init Data entry
-        initdatastart = f.tell()
-        debug.add_offset("MaterialInitData {0}".format(i), initdatastart)
-        
-        #f.seek(start)
-        if offsets["IndirectInitData"] != 0:
-            initdata.indirectdata = IndirectInitData.from_array(f, offsets["IndirectInitData"], real_i)
-        else:
-            initdata.indirectdata = None
 
-        initdata.flag = read_int8_at(f, initdatastart + 0x0)
-        cullmodeIndex = read_int8_at(f, initdatastart + 0x1)
+    def __setattr__(self, name, value):
+        attributes = self.__dict__
+        attributes[name] = value
+        if name[0] != "_":
+            attributes["_dirty"] = True
+
+    # Needs to be called after changing a sub-record in place, e.g. a field of one of the tevstages.
+    # Changing an entry of a list (textures, tevstages, ...) marks the material by itself, see set_unmodified.
+    def mark_dirty(self):
+        self._dirty = True
+
+    # Called once the material matches the section bytes, see MAT1.set_source. The lists are replaced
+    # with OwnedLists, so changing one of their entries in place marks the material as modified again.
+    def set_unmodified(self):
+        attributes = self.__dict__
+        for name, value in attributes.items():
+            if isinstance(value, list):
+                attributes[name] = OwnedList(value, self)
+        attributes["_dirty"] = False
+
+    # Read-only copy for ScreenBlo.freeze. Lists become tuples and the sub-records are shared through pool.
+    def frozen(self, pool):
+        material = frozen_copy(self)
+        attributes = material.__dict__
+        for name, value in attributes.items():
+            if isinstance(value, list):
+                value = tuple(pool.intern(val, copy=True) if isinstance(val, (UnknownData, GXEnum, Color)) else val
+                              for val in value)
+            elif isinstance(value, (UnknownData, GXEnum, Color)):
+                value = pool.intern(value, copy=True)
+            attributes[name] = value
+        return material
+
+    # Read the 0xE8 byte entry at the current position into a dict of fields
+    @staticmethod
+    def read_record(f):
+        values = read_struct(f, MATERIAL_INIT_DATA_STRUCT)
+        record = {}
+        pos = 0
+        for name, fmt, count in MATERIAL_INIT_DATA_LAYOUT:
+            if count == 1:
+                record[name] = values[pos]
+            else:
+                record[name] = list(values[pos:pos+count])
+            pos += count
 
+        return record
 
-        initdata.cullmode = CullModeSetting.from_array(f, offsets["GXCullMode"], cullmodeIndex)
+    # tables are the MaterialTables of f to use, by default a new one
+    @classmethod
+    def from_array(cls, f, start, i, offsets, real_i, tables=None):
+        f.seek(start + i * 0xE8) # 0xE8 is size of Material Init Data entry
+        record = cls.read_record(f)
 
-        colorChannelNumIndex = read_int8_at(f, initdatastart + 0x2)
-        initdata.color_channel_count = read_uint8_at(f, offsets["UcArray2_ColorChannelCount"]+colorChannelNumIndex)
+        if tables is None:
+            tables = MaterialTables(f, offsets)
+        if tables.trace is not None:
+            tables.trace.add_offset("MaterialInitData {0}".format(i), start + i * 0xE8)
+        return cls.from_record(record, tables, real_i, start + i * 0xE8)
 
-        texGenNumIndex = read_int8_at(f, initdatastart + 0x3)
-        initdata.tex_gen_count = read_uint8_at(f, offsets["UcArray3_TexGenCount"]+texGenNumIndex)
-        debug.add_line("TexGenCount: 0x{0:x}".format(initdata.tex_gen_count))
-        tevStageNumIndex = read_int8_at(f, initdatastart + 0x4)
-        initdata.tev_stage_count = read_uint8_at(f, offsets["UCArray6_Tevstagenums"] + tevStageNumIndex)
+    # Build the material from an entry's fields, resolving the indices through the sub-tables.
+    # initdatastart is the position of the entry in the file, for the trace.
+    @classmethod
+    def from_record(cls, record, tables, real_i, initdatastart):
+        initdata = cls()
 
-        ditherIndex = read_int8_at(f, initdatastart + 0x5)
-        
-        initdata.dither = read_uint8_at(f, offsets["UcArray7_Dither"] + ditherIndex)
-        #debug.add_offset("ditherIndex", initdatastart + 0x5, ditherIndex, initdata.dither)
-        unk = read_int8_at(f, initdatastart + 0x6)
-        initdata.unk = unk
+        if tables.offsets["IndirectInitData"] != 0:
+            initdata.indirectdata = tables.get(IndirectInitData, "IndirectInitData", real_i)
+        else:
+            initdata.indirectdata = None
+
+        initdata.flag = record["flag"]
+        initdata.cullmode = tables.get(CullModeSetting, "GXCullMode", record["cullmode"])
+        initdata.color_channel_count = tables.get_uint8("UcArray2_ColorChannelCount", record["color_channel_count"])
+        initdata.tex_gen_count = tables.get_uint8("UcArray3_TexGenCount", record["tex_gen_count"])
+        if tables.trace is not None:
+            tables.trace.add_line("TexGenCount: 0x{0:x}".format(initdata.tex_gen_count))
+        initdata.tev_stage_count = tables.get_uint8("UCArray6_Tevstagenums", record["tev_stage_count"])
+        initdata.dither = tables.get_uint8("UcArray7_Dither", record["dither"])
+        initdata.unk = record["unk"]
         
         # 0x7 padding
-        assert read_int8_at(f, initdatastart + 0x7) == 0x00
+        assert record["padding"] == 0x00
         
         # 2 Mat Colors starting at 0x8 (2 byte index)
-        matColorIndices = read_index_array(f, initdatastart + 0x8, 2, 2)
         initdata.matcolors = []
-        for index in matColorIndices:
+        for index in record["matcolors"]:
             if index == -1:
                 initdata.matcolors.append(None)
             else:
-                color = Color.from_array(f, offsets["MaterialColor"], index)
-                initdata.matcolors.append(color)
+                initdata.matcolors.append(tables.get(Color, "MaterialColor", index))
         
         # 4 ColorChans starting at 0xC (2 byte index) 
-        colorChanIndices = read_index_array(f, initdatastart + 0xC, 2, 4)
-        debug.add_offset("ColorChannelInfo", initdatastart + 0xC, *colorChanIndices)
+        if tables.trace is not None:
+            tables.trace.add_offset("ColorChannelInfo", initdatastart + 0xC, *record["color_channels"])
         initdata.color_channels = []
-        for i in range(4):
-            index = colorChanIndices[i]
+        for index in record["color_channels"]:
             if index == -1:
                 initdata.color_channels.append(None)
             else:
-                initdata.color_channels.append(ChannelControl.from_array(f, offsets["ColorChannelInfo"], index))
-                #if i < 2 or initdata.color_channel_count != 0:
-                #    initdata.color_channels.append(ChannelControl.from_array(f, offsets["ColorChannelInfo"], index))
-                #else:
-                #    initdata.color_channels.append(None)
-
-
+                initdata.color_channels.append(tables.get(ChannelControl, "ColorChannelInfo", index))
 
         # 8 texcoords starting at 0x14 (2 byte index)
-        texCoordIndices = read_index_array(f, initdatastart + 0x14, 2, 8)
         initdata.tex_coord_generators = []
-        for index in texCoordIndices:
+        for index in record["tex_coord_generators"]:
             if index == -1:
                 initdata.tex_coord_generators.append(None)
             else:
-                texcoord = TexCoordInfo.from_array(f, offsets["TexCoordInfo"], index, True)
+                texcoord = tables.get(TexCoordInfo, "TexCoordInfo", index, True)
                 initdata.tex_coord_generators.append(texcoord)
 
         # 8 tex matrices starting at 0x24 (2 byte index) 
-        texMatrixIndices = read_index_array(f, initdatastart + 0x24, 2, 8)
         initdata.tex_matrices = []
-        for index in texMatrixIndices:
-            texmatrix = None if index == -1 else TexMatrix.from_array(f, offsets["TexMatrixInfo"], index)
+        for index in record["tex_matrices"]:
+            texmatrix = None if index == -1 else tables.get(TexMatrix, "TexMatrixInfo", index)
             initdata.tex_matrices.append(texmatrix)
 
         # 0x34-0x37 padding
         
-        # Textures?
-        texcount = 0
-        
-        textureIndices = read_index_array(f, initdatastart + 0x38, 2, 8)
+        # Textures, up to 0x48
         initdata.textures = []
-
-        for i in range(8):
-            index = read_int16_at(f, initdatastart + 0x38 + i*2)
-            if index != -1: # Up to 0x48
-                texcount += 1
-                initdata.textures.append(read_int16_at(f, offsets["UsArray4_TextureIndices"] + index*2))
+        for index in record["textures"]:
+            if index != -1:
+                initdata.textures.append(tables.get_int16("UsArray4_TextureIndices", index))
             else:
                 initdata.textures.append(None)
 
-        font_index = read_int16_at(f, initdatastart + 0x48)
-
-        initdata.font = None if font_index == -1 else FontNumber.from_array(f, offsets["UsArray5"], font_index)
+        font_index = record["font"]
+        initdata.font = None if font_index == -1 else tables.get(FontNumber, "UsArray5", font_index)
         
-        tevkcolor_indices = read_index_array(f, initdatastart + 0x4A, 2, 4)
         initdata.tevkcolors = []
-        for index in tevkcolor_indices:
-            tevkcolor = None if index == -1 else TevKColor.from_array(f, offsets["GXColor2_TevKColors"], index)
+        for index in record["tevkcolors"]:
+            tevkcolor = None if index == -1 else tables.get(TevKColor, "GXColor2_TevKColors", index)
             initdata.tevkcolors.append(tevkcolor)
 
-        TevKColorSels = read_index_array(f, initdatastart + 0x52, 1, 16)
-        initdata.tevkcolor_selects = TevKColorSels
+        initdata.tevkcolor_selects = record["tevkcolor_selects"]
+        initdata.tevkalpha_selects = record["tevkalpha_selects"]
 
-        TevKAlphaSels = read_index_array(f, initdatastart + 0x62, 1, 16)
-        initdata.tevkalpha_selects = TevKAlphaSels
-
-        tevOrderIndices = read_index_array(f, initdatastart + 0x72, 2, 16)
         initdata.tevorders = []
-        for index in tevOrderIndices:
-            tevorder = None if index == -1 else TevOrder.from_array(f, offsets["TevOrderInfo"], index)
+        for index in record["tevorders"]:
+            tevorder = None if index == -1 else tables.get(TevOrder, "TevOrderInfo", index)
             initdata.tevorders.append(tevorder)
 
-        tevcolor_indices = read_index_array(f, initdatastart + 0x92, 2, 4)
         initdata.tevcolors = []
-        for index in tevcolor_indices:
-            tevcolor = None if index == -1 else TevColor.from_array(f, offsets["GXColorS10_TevColor"], index)
+        for index in record["tevcolors"]:
+            tevcolor = None if index == -1 else tables.get(TevColor, "GXColorS10_TevColor", index)
             initdata.tevcolors.append(tevcolor)
         
-        tevstageIndices = read_index_array(f, initdatastart + 0x9A, 2, 16)
         initdata.tevstages = []
-        for index in tevstageIndices:
-            tevstage = None if index == -1 else TevStage.from_array(f, offsets["TevStageInfo2"], index)
+        for index in record["tevstages"]:
+            tevstage = None if index == -1 else tables.get(TevStage, "TevStageInfo2", index)
             initdata.tevstages.append(tevstage)
 
-        tevstageSwapModes = read_index_array(f, initdatastart + 0xBA, 2, 16)
         initdata.tevstage_swapmodes = []
-        for index in tevstageSwapModes:
-            swapmode = None if index == -1 else TevSwapMode.from_array(f, offsets["TevSwapModeInfo"], index, True)
+        for index in record["tevstage_swapmodes"]:
+            swapmode = None if index == -1 else tables.get(TevSwapMode, "TevSwapModeInfo", index, True)
             initdata.tevstage_swapmodes.append(swapmode)
 
-
         # 4 tevswapmode tables starting at 0xDA (2 byte index)
-        tevswapmodeTableIndices = read_index_array(f, initdatastart + 0xDA, 2, 4)
         initdata.tev_swapmode_tables = []
-        for index in tevswapmodeTableIndices:
-            swapmode_table = None if index == -1 else TevSwapModeTable.from_array(f, offsets["TevSwapModeTableInfo"], index)
+        for index in record["tev_swapmode_tables"]:
+            swapmode_table = None if index == -1 else tables.get(TevSwapModeTable, "TevSwapModeTableInfo", index)
             initdata.tev_swapmode_tables.append(swapmode_table)
 
-
-        alphacompIndex = read_int16_at(f, initdatastart + 0xE2)
-        initdata.alphacomp = AlphaCompare.from_array(f, offsets["AlphaCompInfo"], alphacompIndex)
-        blendIndex = read_int16_at(f, initdatastart + 0xE4)
-        initdata.blend = Blend.from_array(f, offsets["BlendInfo"], blendIndex)
+        initdata.alphacomp = tables.get(AlphaCompare, "AlphaCompInfo", record["alphacomp"])
+        initdata.blend = tables.get(Blend, "BlendInfo", record["blend"])
 
         # 2 byte padding
-        assert read_int16_at(f, initdatastart + 0xE6) == 0x0000
+        assert record["padding3"] == 0x0000
         return initdata
 
+    # Build the materials of a MAT1 from all its entries decoded as columns, see NumpyMaterialTables.read_columns.
+    # remap is the entry of each material. Every sub-table entry is decoded once and copied into the materials
+    # using it, instead of being looked up for every index like in from_record. With an InternPool the
+    # shared entries are used as they are.
+    @classmethod
+    def from_columns(cls, columns, tables, remap):
+        assert not any(columns["padding"]) and not any(columns["padding3"])
+        copy = tables.pool is None
+
+        # Value of every material for one field, ordered like the attributes set in from_record
+        def field(name):
+            values = columns[name]
+            return [values[i] for i in remap]
+
+        def entry_field(name, entry_cls, datatype, remember_index=False):
+            values = field(name)
+            entries = tables.entries(entry_cls, datatype, set(values), remember_index)
+            if copy:
+                return [None if index == -1 else entries[index].copy() for index in values]
+            return [entries[index] for index in values]
+
+        def entry_list_field(name, entry_cls, datatype, remember_index=False):
+            values = field(name)
+            entries = tables.entries(entry_cls, datatype, set(index for row in values for index in row),
+                                     remember_index)
+            if copy:
+                return [[None if index == -1 else entries[index].copy() for index in row] for row in values]
+            return [[entries[index] for index in row] for row in values]
+
+        def uint8_field(name, datatype):
+            return [tables.get_uint8(datatype, index) for index in field(name)]
+
+        fields = []
+        if tables.offsets["IndirectInitData"] != 0:
+            fields.append(("indirectdata", [tables.get(IndirectInitData, "IndirectInitData", i)
+                                            for i in range(len(remap))]))
+        else:
+            fields.append(("indirectdata", [None]*len(remap)))
+
+        textures = field("textures")
+        texture_indices = {index: tables.get_int16("UsArray4_TextureIndices", index)
+                           for index in set(index for row in textures for index in row) if index != -1}
+        texture_indices[-1] = None
+
+        fields.extend((
+            ("flag", field("flag")),
+            ("cullmode", entry_field("cullmode", CullModeSetting, "GXCullMode")),
+            ("color_channel_count", uint8_field("color_channel_count", "UcArray2_ColorChannelCount")),
+            ("tex_gen_count", uint8_field("tex_gen_count", "UcArray3_TexGenCount")),
+            ("tev_stage_count", uint8_field("tev_stage_count", "UCArray6_Tevstagenums")),
+            ("dither", uint8_field("dither", "UcArray7_Dither")),
+            ("unk", field("unk")),
+            ("matcolors", entry_list_field("matcolors", Color, "MaterialColor")),
+            ("color_channels", entry_list_field("color_channels", ChannelControl, "ColorChannelInfo")),
+            ("tex_coord_generators", entry_list_field("tex_coord_generators", TexCoordInfo, "TexCoordInfo", True)),
+            ("tex_matrices", entry_list_field("tex_matrices", TexMatrix, "TexMatrixInfo")),
+            ("textures", [[texture_indices[index] for index in row] for row in textures]),
+            ("font", entry_field("font", FontNumber, "UsArray5")),
+            ("tevkcolors", entry_list_field("tevkcolors", TevKColor, "GXColor2_TevKColors")),
+            ("tevkcolor_selects", field("tevkcolor_selects")),
+            ("tevkalpha_selects", field("tevkalpha_selects")),
+            ("tevorders", entry_list_field("tevorders", TevOrder, "TevOrderInfo")),
+            ("tevcolors", entry_list_field("tevcolors", TevColor, "GXColorS10_TevColor")),
+            ("tevstages", entry_list_field("tevstages", TevStage, "TevStageInfo2")),
+            ("tevstage_swapmodes", entry_list_field("tevstage_swapmodes", TevSwapMode, "TevSwapModeInfo", True)),
+            ("tev_swapmode_tables", entry_list_field("tev_swapmode_tables", TevSwapModeTable, "TevSwapModeTableInfo")),
+            ("alphacomp", entry_field("alphacomp", AlphaCompare, "AlphaCompInfo")),
+            ("blend", entry_field("blend", Blend, "BlendInfo"))))
+
+        names = [name for name, values in fields]
+        materials = []
+        for values in zip(*(values for name, values in fields)):
+            material = cls()
+            material.__dict__.update(zip(names, values))
+            materials.append(material)
+        return materials
+
     def write_and_fill_data(self, f, dataarrays):
         start = f.tell()
         write_int8(f, self.flag)  # 0x00
@@ -342,13 +567,11 @@ class MaterialInitData(object):
         write_uint8(f, 0x00)   # 0x07 padding
         assert f.tell() - start == 0x8
 
-        for color in self.matcolors:  # 0x8
-            write_int16(f, get_index_or_add(dataarrays["MaterialColor"], color))
+        write_index_block(f, [get_index_or_add(dataarrays["MaterialColor"], color)
+                              for color in self.matcolors], 2)  # 0x8
 
-        for color_channel in self.color_channels:  # 0xC
-            #print("adding value", color_channel)
-            #print(dataarrays["ColorChannelInfo"])
-            write_int16(f, get_index_or_add(dataarrays["ColorChannelInfo"], color_channel))
+        write_index_block(f, [get_index_or_add(dataarrays["ColorChannelInfo"], color_channel)
+                              for color_channel in self.color_channels], 2)  # 0xC
         # Hardcoding color channel info indices
         #write_int16(f, 0)
         #write_int16(f, 0)
@@ -356,47 +579,41 @@ class MaterialInitData(object):
         #write_int16(f, 1)
         
         assert f.tell() - start == 0x14
-        for texcoord in self.tex_coord_generators:  # 0x14
-            #if texcoord is not None:
-            #    print(len(dataarrays["TexCoordInfo"]))
-            #    print(texcoord, hexlify(texcoord.data), texcoord not in dataarrays["TexCoordInfo"])
-            write_int16(f, get_index_or_add(dataarrays["TexCoordInfo"], texcoord))
+        write_index_block(f, [get_index_or_add(dataarrays["TexCoordInfo"], texcoord)
+                              for texcoord in self.tex_coord_generators], 2)  # 0x14
         assert f.tell() - start == 0x24
 
-        for tex_matrix in self.tex_matrices:  # 0x24
-            write_int16(f, get_index_or_add(dataarrays["TexMatrixInfo"], tex_matrix))
+        write_index_block(f, [get_index_or_add(dataarrays["TexMatrixInfo"], tex_matrix)
+                              for tex_matrix in self.tex_matrices], 2)  # 0x24
 
         f.write(b"\xFF\xFF\xFF\xFF")  # 0x34 - 0x37 padding
 
         assert f.tell() - start == 0x38
-        for tex_index in self.textures:  # 0x38
-            write_int16(f, get_index_or_add(dataarrays["UsArray4_TextureIndices"], tex_index))
+        write_index_block(f, [get_index_or_add(dataarrays["UsArray4_TextureIndices"], tex_index)
+                              for tex_index in self.textures], 2)  # 0x38
 
         write_int16(f, get_index_or_add(dataarrays["UsArray5"], self.font))  # 0x48
         assert f.tell() - start == 0x4A
-        for tevkcolor in self.tevkcolors: # 0x4A
-            write_int16(f, get_index_or_add(dataarrays["GXColor2_TevKColors"], tevkcolor))
-
-        for color_sel in self.tevkcolor_selects:  # 0x52
-            write_int8(f, color_sel)
+        write_index_block(f, [get_index_or_add(dataarrays["GXColor2_TevKColors"], tevkcolor)
+                              for tevkcolor in self.tevkcolors], 2)  # 0x4A
 
-        for alpha_sel in self.tevkalpha_selects:  # 0x62
-            write_int8(f, alpha_sel)
+        write_index_block(f, self.tevkcolor_selects, 1)  # 0x52
+        write_index_block(f, self.tevkalpha_selects, 1)  # 0x62
 
-        for tev_order in self.tevorders:  # 0x72
-            write_int16(f, get_index_or_add(dataarrays["TevOrderInfo"], tev_order))
+        write_index_block(f, [get_index_or_add(dataarrays["TevOrderInfo"], tev_order)
+                              for tev_order in self.tevorders], 2)  # 0x72
 
-        for tev_color in self.tevcolors:  # 0x92
-            write_int16(f, get_index_or_add(dataarrays["GXColorS10_TevColor"], tev_color))
+        write_index_block(f, [get_index_or_add(dataarrays["GXColorS10_TevColor"], tev_color)
+                              for tev_color in self.tevcolors], 2)  # 0x92
 
-        for tev_stage in self.tevstages:  # 0x9A
-            write_int16(f, get_index_or_add(dataarrays["TevStageInfo2"], tev_stage))
+        write_index_block(f, [get_index_or_add(dataarrays["TevStageInfo2"], tev_stage)
+                              for tev_stage in self.tevstages], 2)  # 0x9A
 
-        for tev_stage_swapmode in self.tevstage_swapmodes:  # 0xBA
-            write_int16(f, get_index_or_add(dataarrays["TevSwapModeInfo"], tev_stage_swapmode))
+        write_index_block(f, [get_index_or_add(dataarrays["TevSwapModeInfo"], tev_stage_swapmode)
+                              for tev_stage_swapmode in self.tevstage_swapmodes], 2)  # 0xBA
 
-        for tev_stage_swapmode_table in self.tev_swapmode_tables:  # 0xDA
-            write_int16(f, get_index_or_add(dataarrays["TevSwapModeTableInfo"], tev_stage_swapmode_table))
+        write_index_block(f, [get_index_or_add(dataarrays["TevSwapModeTableInfo"], tev_stage_swapmode_table)
+                              for tev_stage_swapmode_table in self.tev_swapmode_tables], 2)  # 0xDA
 
         write_int16(f, get_index_or_add(dataarrays["AlphaCompInfo"], self.alphacomp))
         write_int16(f, get_index_or_add(dataarrays["BlendInfo"], self.blend))
@@ -407,9 +624,11 @@ class MaterialInitData(object):
     def serialize(self):
         result = {}
         for k, v in self.__dict__.items():
-            if isinstance(v, (UnknownData, GXEnum, Color)):
+            if k[0] == "_":
+                continue
+            elif isinstance(v, (UnknownData, GXEnum, Color)):
                 result[k] = v.serialize()
-            elif isinstance(v, list):
+            elif isinstance(v, (list, tuple)):
                 newlist = []
                 for val in v:
                     if isinstance(val, (UnknownData, GXEnum, Color)):
@@ -464,22 +683,171 @@ class MaterialInitData(object):
 
         return matinitdata
 
+
+
+# Material list of a lazily loaded MAT1 section. Entries stay undecoded until they are accessed,
+# names can be looked up without decoding. Any access marks the list as touched, after which MAT1.write
+# has to rebuild the section instead of writing the original bytes.
+class LazyMaterialList(MutableSequence):
+    def __init__(self, raw, offsets, names, remap, views=False, pool=None, trace=None):
+        self.raw = raw
+        self.reader = BufferReader(raw)
+        # See ParseOptions.zero_copy, pool and trace
+        self.tables = MaterialTables(self.reader, offsets, views, pool, trace)
+        self.offsets = offsets
+        self.names = names
+        self.remap = remap
+        self.items = list(range(len(names)))  # Source material index until decoded
+        self.touched = False
+        self.modified = False  # Materials were replaced, added or removed
+
+    def decode(self, i):
+        item = self.items[i]
+        if isinstance(item, int):
+            material = MaterialInitData.from_array(self.reader, self.offsets["MaterialInitData"], self.remap[item],
+                                                   self.offsets, item, self.tables)
+            material.name = self.names[item]
+            material.set_unmodified()
+            self.items[i] = material
+            return material
+        return item
+
+    def get_name(self, i):
+        item = self.items[i]
+        if isinstance(item, int):
+            return self.names[item]
+        return item.name
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, i):
+        self.touched = True
+        if isinstance(i, slice):
+            return [self.decode(x) for x in range(len(self.items))[i]]
+        return self.decode(i)
+
+    def __setitem__(self, i, value):
+        self.touched = self.modified = True
+        self.items[i] = value
+
+    def __delitem__(self, i):
+        self.touched = self.modified = True
+        del self.items[i]
+
+    def insert(self, i, value):
+        self.touched = self.modified = True
+        self.items.insert(i, value)
+
         
 class MAT1(object):
+    _source = None  # Section bytes the MAT1 was parsed from, see ParseOptions.keep_source
+    _names = None  # Material name -> index of its first material, see get_mat_index
+
     def __init__(self):
         self.name = "MAT1"
         #self.material_names = StringTable()
         self.materials = []
 
+    def get_mat_name(self, index):
+        if isinstance(self.materials, LazyMaterialList):
+            return self.materials.get_name(index)
+        return self.materials[index].name
+
+    # The lookup table is rebuilt when the list was replaced or its length changed, when the found material
+    # no longer has that name, and once on a miss, so materials renamed or replaced in place are found.
     def get_mat_index(self, name):
-        for i, v in enumerate(self.materials):
-            if v.name == name:
-                return i
+        names = self._names
+        if is_frozen(self):
+            return names[2].get(name)
+        if names is None or names[0] is not self.materials or names[1] != len(self.materials):
+            names = self._build_names()
+
+        i = names[2].get(name)
+        if i is None or self.get_mat_name(i) != name:
+            i = self._build_names()[2].get(name)
+        return i
+
+    def _build_names(self):
+        names = {}
+        for i in range(len(self.materials)):
+            names.setdefault(self.get_mat_name(i), i)
+        self._names = (self.materials, len(self.materials), names)
+        return self._names
+
+    def get_material(self, name):
+        index = self.get_mat_index(name)
+        return None if index is None else self.materials[index]
+
+    # Read-only copy for ScreenBlo.freeze, with the materials in a tuple. The original section bytes
+    # are kept if the materials are unchanged since parsing.
+    def frozen(self, pool):
+        mat1 = frozen_copy(self)
+        attributes = mat1.__dict__
+        if self._source is not None and self.is_modified():
+            attributes["_source"] = None
+        if isinstance(self.materials, LazyMaterialList):
+            # Decoding the materials directly leaves the list untouched, the layout can still write the raw section
+            if not self.materials.touched:
+                attributes["_source"] = bytes(self.materials.raw)
+            materials = [self.materials.decode(i) for i in range(len(self.materials))]
+        else:
+            materials = self.materials
+        attributes["materials"] = attributes["_source_materials"] = tuple(material.frozen(pool)
+                                                                          for material in materials)
+        names = {}
+        for i, material in enumerate(mat1.materials):
+            names.setdefault(material.name, i)
+        attributes["_names"] = (mat1.materials, len(mat1.materials), names)
+        return mat1
+
+    def set_source(self, data):
+        self._source = data
+        if isinstance(self.materials, LazyMaterialList):
+            self.materials.modified = False
+        else:
+            self._source_materials = list(self.materials)
+            for material in self.materials:
+                material.set_unmodified()
+
+    # Whether materials were added, removed, replaced or modified since set_source
+    def is_modified(self):
+        if isinstance(self.materials, LazyMaterialList):
+            if self.materials.modified:
+                return True
+            materials = [item for item in self.materials.items if not isinstance(item, int)]
+        else:
+            if (len(self.materials) != len(self._source_materials)
+                    or any(a is not b for a, b in zip(self.materials, self._source_materials))):
+                return True
+            materials = self.materials
+
+        return any(material._dirty for material in materials)
 
-        return None
+    # Remove every material whose index isn't in used.
+    # Returns a dict from the old index of each kept material to its new index.
+    def remove_unused(self, used):
+        remap = {}
+        for i in range(len(self.materials)):
+            if i in used:
+                remap[i] = len(remap)
+
+        if len(remap) < len(self.materials):
+            for i in reversed(range(len(self.materials))):
+                if i not in remap:
+                    del self.materials[i]
+
+        return remap
 
     @classmethod
-    def from_file(cls, f):
+    def from_file(cls, f, options=None):
+        if options is None:
+            options = ParseOptions()
+        if options.mat1_engine not in ("python", "numpy"):
+            raise RuntimeError("Unknown MAT1 engine: {0}".format(options.mat1_engine))
+        if options.mat1_engine == "numpy" and numpy is None:
+            raise RuntimeError("The numpy MAT1 engine requires numpy to be installed")
+
         start = f.tell()
         
         magic = f.read(4)
@@ -487,6 +855,60 @@ class MAT1(object):
             raise RuntimeError("Not a MAT1 section!")
         mat1 = cls()    
         sectionsize = read_uint32(f)
+
+        views = options.zero_copy and isinstance(f, BufferReader)
+
+        if options.lazy_materials:
+            # Keep the raw section, materials are decoded from it on first access
+            if views:
+                raw = f.view(start, sectionsize)
+                f.seek(start + sectionsize)
+            else:
+                f.seek(start)
+                raw = f.read(sectionsize)
+            material_count, offsets, material_names, remap = cls.read_header(BufferReader(raw, 8), 0, options.trace)
+            mat1.materials = LazyMaterialList(raw, offsets, material_names.strings, remap, views, options.pool,
+                                              options.trace)
+            return mat1
+
+        material_count, offsets, material_names, remap = cls.read_header(f, start, options.trace)
+
+        if options.mat1_engine == "numpy":
+            if views:
+                tables = NumpyMaterialTables(f.view(start, sectionsize), start, offsets, True, options.pool,
+                                             options.trace)
+            else:
+                f.seek(start)
+                tables = NumpyMaterialTables(f.read(sectionsize), start, offsets, False, options.pool,
+                                             options.trace)
+            columns = tables.read_columns(max(remap)+1 if remap else 0)
+
+            if options.trace is None:
+                mat1.materials = MaterialInitData.from_columns(columns, tables, remap)
+            else:
+                # Material by material so every lookup is traced
+                for i, initdataindex in enumerate(remap):
+                    initdatastart = offsets["MaterialInitData"] + initdataindex * 0xE8
+                    options.trace.add_offset("MaterialInitData {0}".format(initdataindex), initdatastart)
+                    record = {name: column[initdataindex] for name, column in columns.items()}
+                    mat1.materials.append(MaterialInitData.from_record(record, tables, i, initdatastart))
+            for i, materialinitdata in enumerate(mat1.materials):
+                materialinitdata.name = material_names.strings[i]
+        else:
+            tables = MaterialTables(f, offsets, views, options.pool, options.trace)
+            for i, initdataindex in enumerate(remap):
+                materialinitdata = MaterialInitData.from_array(f, offsets["MaterialInitData"], initdataindex,
+                                                               offsets, i, tables)
+                materialinitdata.name = material_names.strings[i]
+                mat1.materials.append(materialinitdata)
+        f.seek(start+sectionsize)
+
+        return mat1
+
+    # Read the section header following the section size, the material names and the remap table.
+    # Offsets are returned as positions in f, for a section starting at start.
+    @staticmethod
+    def read_header(f, start, trace=None):
         material_count = read_uint16(f)
         
         f.read(2) # padding 
@@ -496,13 +918,10 @@ class MAT1(object):
         # materialinitdata
         
         offsets = {}
-        for datatype in ("MaterialInitData", "MaterialIndexRemapTable", "MaterialNames", "IndirectInitData", "GXCullMode", "MaterialColor",
-                        "UcArray2_ColorChannelCount", "ColorChannelInfo", "UcArray3_TexGenCount", "TexCoordInfo", "TexMatrixInfo", "UsArray4_TextureIndices",
-                        "UsArray5", "TevOrderInfo", "GXColorS10_TevColor", "GXColor2_TevKColors", "UCArray6_Tevstagenums", "TevStageInfo2",
-                        "TevSwapModeInfo", "TevSwapModeTableInfo", "AlphaCompInfo", "BlendInfo", "UcArray7_Dither"):
-            
-            offsets[datatype] = start + read_uint32(f)
-            debug.add_offset("{0}".format(datatype), offsets[datatype])
+        for datatype, offset in zip(MAT1_DATATYPES, read_struct(f, MAT1_OFFSETS_STRUCT)):
+            offsets[datatype] = start + offset
+            if trace is not None:
+                trace.add_offset("{0}".format(datatype), offsets[datatype])
         
         if offsets["IndirectInitData"] == start or offsets["IndirectInitData"]-offsets["MaterialNames"] < 5:
             offsets["IndirectInitData"] = 0
@@ -510,48 +929,36 @@ class MAT1(object):
 
         f.seek(offsets["MaterialNames"])
         material_names = StringTable.from_file(f)
-        
-        for i in range(material_count):
-            f.seek(offsets["MaterialIndexRemapTable"] + i*2)
-            initdataindex = read_uint16(f)
-            
-            f.seek(offsets["MaterialInitData"])
-            materialinitdata = MaterialInitData.from_array(f, offsets["MaterialInitData"], initdataindex, offsets, i)
-            materialinitdata.name = material_names.strings[i]
-            mat1.materials.append(materialinitdata)
-        f.seek(start+sectionsize)
-        
-        debug.write()
-        
-        return mat1
+
+        f.seek(offsets["MaterialIndexRemapTable"])
+        remap = struct.unpack(">{0}H".format(material_count), f.read(material_count*2))
+
+        return material_count, offsets, material_names, remap
 
     def write(self, f):
+        if isinstance(self.materials, LazyMaterialList) and not self.materials.touched:
+            f.write(self.materials.raw)
+            return
+        if self._source is not None and not self.is_modified():
+            f.write(self._source)
+            return
+
         start = f.tell()
-        f.write(b"MAT1")
-        f.write(b"FOOB")  # Fill in later
-        write_int16(f, len(self.materials))
-        f.write(b"\xFF\xFF")  # padding
+        write_struct(f, MAT1_HEADER_STRUCT, b"MAT1", 0, len(self.materials), 0xFFFF)  # Size is filled in later
 
         offsets = {}
         dataarrays = {}
 
-
-        sections = ("MaterialInitData", "MaterialIndexRemapTable", "MaterialNames", "IndirectInitData", "GXCullMode",
-            "MaterialColor",
-            "UcArray2_ColorChannelCount", "ColorChannelInfo", "UcArray3_TexGenCount", "TexCoordInfo", "TexMatrixInfo",
-            "UsArray4_TextureIndices",
-            "UsArray5", "TevOrderInfo", "GXColorS10_TevColor", "GXColor2_TevKColors", "UCArray6_Tevstagenums",
-            "TevStageInfo2",
-            "TevSwapModeInfo", "TevSwapModeTableInfo", "AlphaCompInfo", "BlendInfo", "UcArray7_Dither")
+        sections = MAT1_DATATYPES
         offsets_start = f.tell()
         for datatype in sections:
             offsets[datatype] = None
-            dataarrays[datatype] = []
-            f.write(b"FOOB")
+            dataarrays[datatype] = DataArray()
+        f.write(bytes(MAT1_OFFSETS_STRUCT.size))  # Filled in later
 
-        dataarrays["GXCullMode"] = [CullModeSetting(2),
-                                    CullModeSetting(1),
-                                    CullModeSetting(0)]
+        dataarrays["GXCullMode"] = DataArray([CullModeSetting(2),
+                                              CullModeSetting(1),
+                                              CullModeSetting(0)])
 
         has_indirectdata = False
         offsets["MaterialInitData"] = f.tell()-start
@@ -575,13 +982,23 @@ class MAT1(object):
         
         dataarrays["TexCoordInfo"].sort(key=lambda x: x.index)
         dataarrays["TevSwapModeInfo"].sort(key=lambda x: x.index)
-        print(dataarrays["TevSwapModeInfo"])
         
         dataarrays["UcArray7_Dither"].append(0)
         dataarrays["UcArray7_Dither"].append(1)
         
+        # Materials that only differ in their name share one init data record through the remap table
+        records = {}
+        remap = []
         for material in self.materials:
-            material.write_and_fill_data(f, dataarrays)
+            record = BufferWriter(0xE8)
+            material.write_and_fill_data(record, dataarrays)
+            record = record.getvalue()
+
+            if record not in records:
+                records[record] = len(records)
+                f.write(record)
+            remap.append(records[record])
+
             if material.indirectdata is not None:
                 has_indirectdata = True
 
@@ -593,8 +1010,7 @@ class MAT1(object):
 
 
         offsets["MaterialIndexRemapTable"] = f.tell()-start
-        for i, material in enumerate(self.materials):
-            write_int16(f, i)
+        f.write(struct.pack(">{0}h".format(len(remap)), *remap))
         write_pad(f, 4)
         offsets["MaterialNames"] = f.tell()-start
         material_names = StringTable()
@@ -621,12 +1037,9 @@ class MAT1(object):
                 continue
             #print("offset", offsets[datatype])
             if datatype in ("UcArray2_ColorChannelCount", "UcArray3_TexGenCount", "UCArray6_Tevstagenums", "UcArray7_Dither"):
-                for data in dataarrays[datatype]:
-                    write_uint8(f, data)
+                f.write(struct.pack(">{0}B".format(len(dataarrays[datatype])), *dataarrays[datatype]))
             elif datatype in ("UsArray4_TextureIndices", ):
-                for data in dataarrays[datatype]:
-                    #print(data, type(data))
-                    write_uint16(f, data)
+                f.write(struct.pack(">{0}H".format(len(dataarrays[datatype])), *dataarrays[datatype]))
             else:
                 for data in dataarrays[datatype]:
                     #print(data)
@@ -636,15 +1049,8 @@ class MAT1(object):
         write_pad(f, 0x20)
         total = f.tell()
 
-        f.seek(offsets_start)
-        for datatype in sections:
-            offset = offsets[datatype]
-            write_uint32(f, offset)
-
-        f.seek(start+4)
-        write_uint32(f, total-start)  # section size
-
-        f.seek(total)
+        patch_struct(f, MAT1_OFFSETS_STRUCT, offsets_start, *[offsets[datatype] for datatype in sections])
+        patch_struct(f, MAT1_HEADER_STRUCT, start, b"MAT1", total-start, len(self.materials), 0xFFFF)  # section size
 
     def serialize(self):
         result = {"type": "MAT1"}
@@ -684,13 +1090,7 @@ class MAT1(object):
                 for i in range(len(material["textures"])):
                     val = material["textures"][i]
                     if isinstance(val, str):
-                        if val in textures.references:
-                            pos = textures.references.index(val)
-                        else:
-                            textures.references.append(val)
-                            pos = len(textures.references)-1
-                            assert textures.references[pos] == val
-                        material["textures"][i] = pos
+                        material["textures"][i] = textures.get_index_or_add(val)
 
             for material in obj["Materials"]:
                 for i in range(len(material["textures"])):
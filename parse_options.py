@@ -0,0 +1,69 @@
+import logging
+from collections import deque
+
+
+logger = logging.getLogger("pyblo2")
+
+
+# Options controlling how a BLO file is parsed, passed down from ScreenBlo.from_file to the section parsers
+class ParseOptions(object):
+    def __init__(self, mat1_engine="python", lazy_materials=False, verify=False, report=None, keep_source=False,
+                 sections=None, zero_copy=False, pool=None, trace=None):
+        # "python" decodes MAT1 material by material, "numpy" decodes all material tables at once and every
+        # sub-table entry only once (needs numpy)
+        self.mat1_engine = mat1_engine
+        # Keep MAT1 undecoded and only decode a material when it is accessed. An untouched MAT1
+        # is written back as the original section bytes.
+        self.lazy_materials = lazy_materials
+        # Re-read every section after parsing it and check the parser consumed exactly the section size.
+        # Results are passed to report(level, message) with a logging level, WARNING for sections the parser
+        # didn't read exactly and INFO for the others. By default they go to the "pyblo2" logger.
+        self.verify = verify
+        self.report = report if report is not None else logger.log
+        # Keep the original bytes of every pane, TEX1, FNT1 and MAT1 section. Sections that weren't
+        # modified since are written back as those bytes instead of being encoded again.
+        self.keep_source = keep_source
+        # Section handlers replacing the registered ones for this parse, by section magic, e.g.
+        # {"MAT1": RAW_SECTION, "PIC2": RAW_SECTION} or {"TBX2": SKIP_SECTION}, see readblo2.register_section
+        # Pictures need the decoded MAT1 in scope, so a MAT1 that is kept raw or skipped needs PIC2
+        # to be kept raw or skipped too.
+        if sections:
+            materials = getattr(sections.get("MAT1"), "event", "materials")
+            pictures = getattr(sections.get("PIC2"), "event", "pane")
+            if materials != "materials" and pictures not in ("raw", None):
+                raise ValueError("MAT1 is {0} but PIC2 is decoded, and pictures need the decoded MAT1 to "
+                                 "resolve their material names. Use RAW_SECTION or SKIP_SECTION for PIC2 too."
+                                 .format("skipped" if materials is None else "kept raw"))
+        self.sections = sections
+        # Keep large MAT1 sub-records like IndirectInitData (see mat1.VIEW_MIN_SIZE) and lazy MAT1 sections
+        # as memoryviews into the buffer being parsed instead of copies. Only used when parsing from a buffer
+        # (ScreenBlo.from_buffer). The views keep the whole buffer alive, and see changes made to a writable
+        # buffer afterwards.
+        self.zero_copy = zero_copy
+        # A mat1.datatypes.InternPool: MAT1 sub-records and colors with the same value share one frozen
+        # instance, within a file or between all files parsed with the same pool
+        self.pool = pool
+        # A TraceContext collecting the offsets and values seen while decoding MAT1, off by default
+        self.trace = trace
+
+
+# Trace of a single parse, see ParseOptions.trace. Keeps the last maxlen lines and passes every
+# line to callback if there is one. Use a separate context for each parse running at the same time.
+class TraceContext(object):
+    def __init__(self, maxlen=1000, callback=None):
+        self.lines = deque(maxlen=maxlen)
+        self.callback = callback
+
+    def add_line(self, data):
+        self.lines.append(data)
+        if self.callback is not None:
+            self.callback(data)
+
+    def add_offset(self, name, offset, *args):
+        more = ""
+        for v in args:
+            more += str(v)+" "
+        self.add_line("{}: 0x{:x}".format(name, offset)+" "+more)
+
+    def clear(self):
+        self.lines.clear()
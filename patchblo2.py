@@ -0,0 +1,109 @@
+import mmap
+import struct
+from readblo2 import PANE_NAME_OFFSETS, load_section_index
+
+
+# Fields of the PAN2 header that can be changed in place, with their offset from the start of the
+# PAN2 header and their format. WIN2, PIC2 and TBX2 sections start with their own 8 byte section header
+# followed by a PAN2 header.
+PANE_FIELDS = {
+    "p_unk1": (0x0A, struct.Struct(">H")),
+    "p_enabled": (0x0C, struct.Struct(">B")),
+    "p_anchor": (0x0D, struct.Struct(">B")),
+    "p_panename": (0x10, struct.Struct(">8s")),
+    "p_secondaryname": (0x18, struct.Struct(">8s")),
+    "p_size_x": (0x20, struct.Struct(">f")),
+    "p_size_y": (0x24, struct.Struct(">f")),
+    "p_scale_x": (0x28, struct.Struct(">f")),
+    "p_scale_y": (0x2C, struct.Struct(">f")),
+    "p_rotation": (0x38, struct.Struct(">f")),
+    "p_offset_x": (0x3C, struct.Struct(">f")),
+    "p_offset_y": (0x40, struct.Struct(">f")),
+    "p_unk4": (0x44, struct.Struct(">f"))
+}
+
+
+# Change pane header fields of a .blo file in place through mmap, without parsing or rewriting
+# the rest of the file. Panes are looked up by p_panename, names shorter than 8 characters are
+# padded with null bytes like in the file.
+#
+#   with PanePatcher("file.blo") as blo:
+#       blo.set("mypane", "p_offset_x", 100.0)
+#       blo.set("otherpan", "p_enabled", 0)
+class PanePatcher(object):
+    def __init__(self, path):
+        self.path = path
+        self.panes = {}  # p_panename -> offsets of the PAN2 headers of the panes with that name
+        for section in load_section_index(path, write_sidecar=False):
+            if section.panename is not None:
+                offset = section.offset + PANE_NAME_OFFSETS[section.magic] - PANE_FIELDS["p_panename"][0]
+                self.panes.setdefault(section.panename, []).append(offset)
+
+        self.file = open(path, "r+b")
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+            self.map = None
+
+    @staticmethod
+    def pad_name(panename):
+        if len(panename) > 8:
+            raise RuntimeError("Pane name longer than 8 characters: {0}".format(panename))
+        return panename.ljust(8, "\x00")
+
+    def find(self, panename):
+        return self.panes.get(self.pad_name(panename), [])
+
+    # Values of the field for every pane with that name, in file order
+    def get(self, panename, field):
+        offset, fmt = PANE_FIELDS[field]
+        values = [fmt.unpack_from(self.map, header + offset)[0] for header in self.find(panename)]
+        if field in ("p_panename", "p_secondaryname"):
+            values = [value.decode("ascii") for value in values]
+        return values
+
+    # Set the field of every pane with that name. Returns the number of changed panes.
+    def set(self, panename, field, value):
+        offset, fmt = PANE_FIELDS[field]
+        headers = self.find(panename)
+        if field in ("p_panename", "p_secondaryname"):
+            value = bytes(self.pad_name(value), encoding="ascii")
+
+        for header in headers:
+            fmt.pack_into(self.map, header + offset, value)
+
+        if field == "p_panename" and headers:
+            del self.panes[self.pad_name(panename)]
+            self.panes.setdefault(value.decode("ascii"), []).extend(headers)
+
+        return len(headers)
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 5:
+        print("Usage: patchblo2.py panename field value file.blo [file.blo ...]")
+        sys.exit(1)
+
+    panename, field, value = sys.argv[1:4]
+    if field not in PANE_FIELDS:
+        raise RuntimeError("Unknown field: {0}, can be one of {1}".format(field, ", ".join(PANE_FIELDS)))
+    if PANE_FIELDS[field][1].format.endswith("f"):
+        value = float(value)
+    elif field not in ("p_panename", "p_secondaryname"):
+        value = int(value, 0)
+
+    for path in sys.argv[4:]:
+        with PanePatcher(path) as blo:
+            count = blo.set(panename, field, value)
+        print("{0}: {1} pane(s) changed".format(path, count))
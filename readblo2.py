@@ -1,8 +1,220 @@
+import json
+import logging
+import os
+import struct
+import tempfile
+from collections.abc import Mapping
 from math import radians, sin, cos
 from binary_io import *
 from binascii import hexlify, unhexlify
 from mat1.mat1 import MAT1
-from mat1.datatypes import Color
+from mat1.datatypes import Color, FontNumber, InternPool, OwnedList, frozen_copy, is_frozen
+from parse_options import ParseOptions
+from section_schema import SectionCodec, Field, Const, Arg, Extra, ASCII, HEX, HEX_INT
+
+
+# Base of the slotted records nested in pane sections. They can be used like the dicts they replace
+# in the JSON files, as a mapping of their JSON values. _fields are the keys, in JSON order.
+# Changing a field marks the pane holding the record (_owner) as modified.
+class SectionRecord(Mapping):
+    __slots__ = ("_owner", )
+    _fields = ()
+
+    def __setattr__(self, name, value):
+        _set_attr(self, name, value)
+        if name[0] != "_":
+            owner = getattr(self, "_owner", None)  # Not set yet while unpickling
+            if owner is not None:
+                owner.mark_dirty()
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self._fields:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return "{0}({1})".format(type(self).__name__, ", ".join(
+            "{0}={1!r}".format(key, getattr(self, key)) for key in self._fields))
+
+    # Read-only copy for ScreenBlo.freeze, lists become tuples
+    def frozen(self):
+        record = frozen_copy(self)
+        _set_attr(record, "_owner", None)
+        for key in self._fields:
+            value = getattr(self, key)
+            if isinstance(value, list):
+                _set_attr(record, key, tuple(value))
+        return record
+
+
+# Corner, side and filling material of a window. sub_unk3 is kept as an int but is a hex string
+# in the JSON files and when used as a mapping.
+class WindowSubdata(SectionRecord):
+    __slots__ = _fields = ("material", "sub_unk2", "sub_unk3")
+
+    def __init__(self, material=0, sub_unk2=0, sub_unk3=0, owner=None):
+        _set_attr(self, "_owner", owner)
+        _set_attr(self, "material", material)
+        _set_attr(self, "sub_unk2", sub_unk2)
+        _set_attr(self, "sub_unk3", sub_unk3)
+
+    def __getitem__(self, key):
+        if key == "sub_unk3":
+            return hex(self.sub_unk3)
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        if key == "sub_unk3":
+            value = int(value, 16)
+        super().__setitem__(key, value)
+
+
+class PictureColor(SectionRecord):
+    __slots__ = _fields = ("unk1", "unk2", "unknowns", "col1", "col2")
+
+    def __init__(self, unk1=0, unk2=0, unknowns=None, col1=None, col2=None, owner=None):
+        _set_attr(self, "_owner", owner)
+        _set_attr(self, "unk1", unk1)
+        _set_attr(self, "unk2", unk2)
+        _set_attr(self, "unknowns", unknowns if unknowns is not None else [0, 0, 0, 0])
+        _set_attr(self, "col1", col1 if col1 is not None else [0, 0, 0, 0])
+        _set_attr(self, "col2", col2 if col2 is not None else [0, 0, 0, 0])
+
+
+# Top and bottom text color of a textbox. Changing a channel marks the textbox (_owner) as modified.
+class PaneColor(Color):
+    __slots__ = ("_owner", )
+
+    def __init__(self, r, g, b, a, owner=None):
+        _set_attr(self, "_owner", owner)
+        _set_attr(self, "r", r)
+        _set_attr(self, "g", g)
+        _set_attr(self, "b", b)
+        _set_attr(self, "a", a)
+
+    def __setattr__(self, name, value):
+        _set_attr(self, name, value)
+        if name[0] != "_":
+            owner = getattr(self, "_owner", None)  # Not set yet while unpickling
+            if owner is not None:
+                owner.mark_dirty()
+
+
+# Layouts of the fixed-size sections, see section_schema. The codecs generated from them decode
+# a section with a single unpack and write it with a single pack.
+# Every pane type embeds the 0x48 byte PAN2 header right after its own magic and size.
+PANE_LAYOUT = [
+    Field("p_name", "4s", ASCII, key="p_type", choices=("PAN2", "pan2"), error="Not a PAN2 or pan2 section but {}"),
+    Const(0x48, "I"),
+    Const(0x40, "H"),
+    Field("p_unk1", "H"),
+    Field("p_enabled", "B"),
+    Field("p_anchor", "B"),
+    Const(b"RE", "2s", (b"RE", b"\x00\x00")),
+    Field("p_panename", "8s", ASCII),
+    Field("p_secondaryname", "8s", ASCII),
+    Field("p_size_x", "f"),
+    Field("p_size_y", "f"),
+    Field("p_scale_x", "f"),
+    Field("p_scale_y", "f"),
+    Const(0.0, "f"),
+    Const(0.0, "f"),
+    Field("p_rotation", "f"),
+    Field("p_offset_x", "f"),
+    Field("p_offset_y", "f"),
+    Field("p_unk4", "f")
+]
+# The PAN2 fields come first in the JSON files, in this order
+PANE_ORDER = ("p_type", "p_anchor", "p_size_x", "p_size_y", "p_scale_x", "p_scale_y", "p_offset_x", "p_offset_y",
+              "p_rotation", "p_panename", "p_secondaryname", "p_unk1", "p_enabled", "p_unk4")
+
+WINDOW_LAYOUT = [Const(b"WIN2", "4s", error="Not a WIN2 section: {}"), Const(0x90, "I")] + PANE_LAYOUT + [
+    Field("size", "H"),
+    Const(b"RESERV", "6s", (b"RESERV", b"\x00"*6)),
+    Field("padding", "8s", HEX)
+] + [Field(("subdata", i, "material"), "h") for i in range(4)] + [
+    Field("unkbyte1", "B"),
+    Field("unkbyte2", "B"),
+    Field("unk3", "H"),
+    Field("unk4", "H"),
+    Field("unk5", "H"),
+    Field("unk6", "H"),
+    Field("unk7", "H"),
+    Field("material", "h"),
+    Const(b"RE", "2s", (b"RE", b"\x00\x00"))
+] + [Field(("subdata", i, "sub_unk2"), "H") for i in range(4)] + [
+    Field(("subdata", i, "sub_unk3"), "I", json_conv=HEX_INT) for i in range(4)]
+
+# The material is stored as an index but kept as the material name
+PICTURE_LAYOUT = [Const(b"PIC2", "4s", error="Not a PIC2 section: {}"), Const(0x80, "I")] + PANE_LAYOUT + [
+    Field("size", "H"),
+    Field("unk_index", "H"),
+    Arg("material_index", "H"),
+    Extra("material"),
+    Const(b"RE", "2s", (b"RE", b"\x00\x00"))
+] + [Field((color, key), "H") for color in ("color1", "color2") for key in ("unk1", "unk2")] + [
+    Field((color, "unknowns", i), "H") for color in ("color1", "color2") for i in range(4)] + [
+    Field((color, key, i), "B") for color in ("color1", "color2") for key in ("col1", "col2") for i in range(4)]
+
+# Followed by the text and padding to 8 bytes, which are included in the section size
+TEXTBOX_LAYOUT = [Const(b"TBX2", "4s", error="Not a TBX2 section: {}"), Arg("section_size", "I")] + PANE_LAYOUT + [
+    Field("size", "H"),
+    Field("unk1", "H"),
+    Field("material", "H"),
+    Field("signedunk3", "h"),
+    Field("signedunk4", "h"),
+    Field("unk5", "H"),
+    Field("unk6", "H"),
+    Field("unk7byte", "B"),
+    Field("unk8byte", "B")
+] + [Field((color, channel), "B", key=(color, i)) for color in ("color_top", "color_bottom")
+     for i, channel in enumerate("rgba")] + [
+    Field("unk11", "B"),
+    Const(b"RES", "3s", (b"RES", b"\x00\x00\x00")),
+    Field("text_cutoff", "H"),
+    Arg("text_length", "H"),
+    Extra("text")
+]
+
+# Followed by 0x10 bytes of padding
+INFORMATION_LAYOUT = [
+    Const(b"INF1", "4s", error="Not an INF1 section: {}"),
+    Const(0x20, "I"),
+    Field("width", "H"),
+    Field("height", "H")
+] + [Field("val{0}".format(i+1), "B", key=("values", i)) for i in range(4)]
+
+PANE_CODEC = SectionCodec(PANE_LAYOUT, "PAN2", PANE_ORDER)
+WINDOW_CODEC = SectionCodec(WINDOW_LAYOUT, "WIN2", PANE_ORDER,
+                            types={("subdata", i): WindowSubdata for i in range(4)})
+PICTURE_CODEC = SectionCodec(PICTURE_LAYOUT, "PIC2", PANE_ORDER,
+                             types={("color1", ): PictureColor, ("color2", ): PictureColor})
+TEXTBOX_CODEC = SectionCodec(TEXTBOX_LAYOUT, "TBX2", PANE_ORDER,
+                             types={("color_top", ): PaneColor, ("color_bottom", ): PaneColor})
+INFORMATION_CODEC = SectionCodec(INFORMATION_LAYOUT, "INF1")
+
+SECTION_HEADER_STRUCT = struct.Struct(">4sI")
+RESOURCE_HEADER_STRUCT = struct.Struct(">4sIHHI")
+FILE_HEADER_STRUCT = struct.Struct(">8sII")
+FILE_HEADER_SIZE = 0x20
+
+# Pane attributes that only exist in the editor or link panes together, setting them doesn't modify the section
+PANE_UNTRACKED_FIELDS = ("child", "parent", "widget", "hide")
+_set_attr = object.__setattr__
+
+# Offset of p_panename from the start of each pane section
+PANE_NAME_OFFSETS = {"PAN2": 0x10, "WIN2": 0x18, "PIC2": 0x18, "TBX2": 0x18}
 
 
 class Node(object): 
@@ -11,103 +223,153 @@ class Node(object):
         self.materials = None 
         self.textures = None 
         
-    def print_hierarchy(self, indent=0):
-        for child in self.children:
-            if isinstance(child, Node):
-                child.print_hierarchy(indent+4)
+    # Walk the tree without recursion. Yields (event, item, node, depth) tuples:
+    #   ("item", child, node, depth) for every child of a node, in file order
+    #   ("enter", pane, child node, depth) and ("exit", pane, child node, depth) around the
+    #   children of a pane that has a child node (a BGN1/END1 block in the file)
+    def walk(self):
+        stack = [(self, iter(self.children), None)]
+        while stack:
+            node, children, owner = stack[-1]
+            depth = len(stack) - 1
+            for child in children:
+                yield "item", child, node, depth
+
+                childnode = getattr(child, "child", None)
+                if childnode is not None:
+                    yield "enter", child, childnode, depth
+                    stack.append((childnode, iter(childnode.children), child))
+                    break
             else:
-                print("{0}{1}".format(indent*"-", child.name))
-    
+                stack.pop()
+                if owner is not None:
+                    yield "exit", owner, node, depth - 1
+
+    # Yields (pane, depth, parent) for every pane in the tree, parent is None for top level panes
+    def iter_panes(self):
+        owners = [None]
+        for event, item, node, depth in self.walk():
+            if event == "item":
+                if isinstance(item, Pane):
+                    yield item, depth, owners[-1]
+            elif event == "enter":
+                owners.append(item)
+            else:
+                owners.pop()
+
+    def print_hierarchy(self, indent=0):
+        for event, item, node, depth in self.walk():
+            if event == "item":
+                print("{0}{1}".format((indent + depth*4)*"-", item.name))
+
+    # Build a tree from a stream of events as produced by iter_events or iter_serialized_events
     @classmethod
-    def from_file(cls, f, materials=None, textures=None):
+    def from_events(cls, events, materials=None, textures=None):
         node = cls()
         node.materials = materials 
         node.textures = textures
+        stack = []
+
+        for event, item in events:
+            if event == "enter_child":
+                stack.append(node)
+                childnode = cls()
+                childnode.materials = node.materials
+                childnode.textures = node.textures
+                node = childnode
+            elif event == "exit_child":
+                item.child = node
+                for child in node.children:
+                    child.parent = item
+                node = stack.pop()
+            else:
+                if event == "textures":
+                    node.textures = item
+                elif event == "materials":
+                    node.materials = item
+                node.children.append(item)
 
+        if stack:
+            raise RuntimeError("Unterminated child block")
+        return node
+
+    @classmethod
+    def from_file(cls, f, materials=None, textures=None, options=None):
+        return cls.from_events(cls.iter_events(f, materials, options), materials, textures)
+
+    # Stream the sections following INF1 as (event, item) tuples, see ScreenBlo.iter_events
+    @staticmethod
+    def iter_events(f, materials=None, options=None):
+        if options is None:
+            options = ParseOptions()
+
+        handlers = get_section_handlers(options)[0]
         last = None
+        blocks = []  # (owning pane, materials in scope) of the open BGN1 blocks
 
         next = peek_id(f)
         while next != b"EXT1":
+            start = f.tell()
             if next == b"BGN1":
                 f.read(8)
-
-                childnode = Node.from_file(f, node.materials, node.textures)
-                last.child = childnode
-                for child in childnode.children:
-                    child.parent = last
-
-                #node.children.append(childnode)
+                if last is SKIP_SECTION:
+                    skip_child_block(f)
+                    last = None
+                    next = peek_id(f)
+                    continue
+                if last is None:
+                    raise RuntimeError("BGN1 section without a preceding pane")
+                blocks.append((last, materials))
+                event, item = "enter_child", last
                 last = None
-            elif next == b"END1" or next == b"EXT1":
+            elif next == b"END1":
                 f.read(8)
-                return node 
-            elif next == b"TEX1":
-                node.textures = TextureNames.from_file(f)
-                print("set the tex1", node.textures)
-                node.children.append(node.textures)
-            elif next == b"FNT1":
-                node.children.append(FontNames.from_file(f))
-            elif next == b"MAT1":
-                print("Set the materials")
-                thing = f.tell()
-                mat1 = MAT1.from_file(f)
-                spot = f.tell()
-                f.seek(thing)
-                Item.from_file(f)
-                print("compare", hex(spot), hex(f.tell()))
-                node.materials = mat1#Item.from_file(f)
-                node.children.append(node.materials)
-                print(len(mat1.materials), "materials")
-                #print(mat1.material_names.strings)
-            
-            elif next == b"PAN2":
-                last = Pane.from_file(f)
-                node.children.append(last)
-            elif next == b"PIC2":
-                last = Picture.from_file(f, materials)
-
-                node.children.append(last)
-            elif next == b"WIN2":
-                last = Window.from_file(f)
-                node.children.append(last)
-            elif next == b"TBX2":
-                last = Textbox.from_file(f)
-                node.children.append(last)
-            elif not next:
-                raise RuntimeError("malformed file?")
+                if not blocks:
+                    raise RuntimeError("END1 section without a matching BGN1")
+                owner, materials = blocks.pop()
+                last = None
+                event, item = "exit_child", owner
             else:
-                raise RuntimeError("Unknown: {0}".format(next))
-            
+                handler = handlers.get(next)
+                if handler is None:
+                    if not next:
+                        raise RuntimeError("malformed file?")
+                    raise RuntimeError("Unknown: {0}".format(next))
+
+                event, item = handler.read(f, materials, options)
+                if event is None:
+                    last = SKIP_SECTION
+                    next = peek_id(f)
+                    continue
+                elif event == "materials":
+                    materials = item
+                elif event in ("pane", "raw"):
+                    last = item
+
+            if options.verify:
+                verify_section(f, start, item if event == "materials" else None, options)
+            if options.keep_source and event not in ("enter_child", "exit_child"):
+                end = f.tell()
+                f.seek(start)
+                item.set_source(f.read(end - start))
+            yield event, item
+
             next = peek_id(f)
-        
-        return node 
-    
+
     def write(self, f):
         count = 0
-        for child in self.children:
-            """if isinstance(child, Node):
-                f.write(b"BGN1")
-                write_uint32(f, 8)
-                count += child.write(f) + 2
-                f.write(b"END1")
-                write_uint32(f, 8)
-            else:
+        for event, item, node, depth in self.walk():
+            if event == "item":
                 count += 1
-                child.write(f)"""
-
-            count += 1
-            if isinstance(child, Pane):
-                child.write(f, self.materials)
-            else:
-                child.write(f)
-            if hasattr(child, "child") and child.child is not None:
+                if isinstance(item, Pane):
+                    item.write(f, node.materials)
+                else:
+                    item.write(f)
+            elif event == "enter":
                 f.write(b"BGN1")
                 write_uint32(f, 8)
-                if isinstance(child.child, Pane):
-                    count += child.child.write(f, self.materials) + 2
-                else:
-                    count += child.child.write(f) + 2
-                
+                count += 2
+            else:
                 f.write(b"END1")
                 write_uint32(f, 8)
 
@@ -115,61 +377,137 @@ class Node(object):
 
     def serialize(self):
         result = []
-        for child in self.children:
-            if isinstance(child, MAT1):
-                result.append(child.postprocess_serialize(self.textures))
+        stack = []
+        for event, item, node, depth in self.walk():
+            if event == "item":
+                if isinstance(item, MAT1):
+                    result.append(item.postprocess_serialize(node.textures))
+                else:
+                    result.append(item.serialize())
+            elif event == "enter":
+                stack.append(result)
+                childresult = []
+                result.append(childresult)
+                result = childresult
             else:
-                result.append(child.serialize())
-                if hasattr(child, "child") and child.child is not None:
-                    result.append(child.child.serialize())
+                result = stack.pop()
         
         return result 
     
     @classmethod 
-    def deserialize(cls, obj, materials=None, textures=None):
-        node = cls()
-        node.textures = textures
-        node.materials = materials
+    def deserialize(cls, obj, materials=None, textures=None, options=None):
+        return cls.from_events(cls.iter_serialized_events(obj, textures, options), materials, textures)
+
+    # Read-only copy of the tree with the children in tuples, see ScreenBlo.freeze
+    def freeze(self, pool):
+        copies = {}  # id(item) -> its frozen copy, for the MAT1 and TEX1 the nodes refer to
+
+        def frozen_node(node, children):
+            copy = frozen_copy(node)
+            _set_attr(copy, "children", tuple(children))
+            for name in ("materials", "textures"):
+                item = getattr(node, name)
+                if item is not None and id(item) not in copies:
+                    copies[id(item)] = item.frozen(pool)
+                _set_attr(copy, name, None if item is None else copies[id(item)])
+            return copy
+
+        stack = []
+        children = []
+        for event, item, node, depth in self.walk():
+            if event == "item":
+                if id(item) not in copies:
+                    copies[id(item)] = item.frozen(pool)
+                children.append(copies[id(item)])
+            elif event == "enter":
+                stack.append(children)
+                children = []
+            else:
+                owner = copies[id(item)]
+                _set_attr(owner, "child", frozen_node(node, children))
+                for child in children:
+                    if isinstance(child, Pane):
+                        _set_attr(child, "parent", owner)
+                children = stack.pop()
 
-        last = None
+        return frozen_node(self, children)
 
-        for item in obj:
-            add_item = True
-            if isinstance(item, list):
-                bloitem = Node.deserialize(item, node.materials, node.textures)
-                last.child = bloitem
-                for child in bloitem.children:
-                    child.parent = last
-                last = None
-                add_item = False
-            elif item["type"] == "TEX1":
-                bloitem = TextureNames.deserialize(item)
-                node.textures = bloitem
-            elif item["type"] == "FNT1":
-                bloitem = FontNames.deserialize(item)
-            elif item["type"] == "PAN2":
-                bloitem = Pane.deserialize(item)
-                last = bloitem
-            elif item["type"] == "WIN2":
-                bloitem = Window.deserialize(item)
-                last = bloitem
-            elif item["type"] == "TBX2":
-                bloitem = Textbox.deserialize(item)
-                last = bloitem
-            elif item["type"] == "PIC2":
-                bloitem = Picture.deserialize(item)
-                last = bloitem
-            elif item["type"] == "MAT1":
-                bloitem = MAT1.preprocess_deserialize(item, node.textures)
-                node.materials = bloitem
+    # Turn serialized nodes (nested lists of items) into the same events as iter_events
+    @staticmethod
+    def iter_serialized_events(obj, textures=None, options=None):
+        if options is None:
+            options = ParseOptions()
+
+        handlers = get_section_handlers(options)[1]
+        last = None
+        items = iter(obj)
+        stack = []  # (remaining items, owning pane, textures in scope) of the enclosing lists
+
+        while True:
+            for item in items:
+                if isinstance(item, list):
+                    if last is SKIP_SECTION:
+                        last = None
+                        continue
+                    if last is None:
+                        raise RuntimeError("Child list without a preceding pane")
+                    yield "enter_child", last
+                    stack.append((items, last, textures))
+                    items = iter(item)
+                    last = None
+                    break
+
+                handler = handlers.get(item["type"])
+                if handler is None:
+                    raise RuntimeError("Unknown item {0}".format(item["type"]))
+
+                event, result = handler.deserialize(item, textures)
+                if event is None:
+                    last = SKIP_SECTION
+                    continue
+                elif event == "textures":
+                    textures = result
+                elif event in ("pane", "raw"):
+                    last = result
+                yield event, result
             else:
-                raise RuntimeError("Unknown item {0}".format(item["type"]))
-            if add_item:
-                node.children.append(bloitem)
-        
-        return node 
-    
-        
+                if not stack:
+                    return
+                items, owner, textures = stack.pop()
+                last = None
+                yield "exit_child", owner
+
+
+# Move past a BGN1/END1 block whose BGN1 header was already read, including nested blocks
+def skip_child_block(f):
+    depth = 1
+    while depth > 0:
+        start = f.tell()
+        magic, size = read_struct(f, SECTION_HEADER_STRUCT)
+        if magic == b"BGN1":
+            depth += 1
+        elif magic == b"END1":
+            depth -= 1
+        elif magic == b"EXT1" or size < SECTION_HEADER_STRUCT.size:
+            raise RuntimeError("Unterminated child block")
+        f.seek(start + size)
+
+
+# Re-read a parsed section as raw data and report whether the parser stopped where the section ends
+def verify_section(f, start, mat1, options):
+    end = f.tell()
+    f.seek(start)
+    item = Item.from_file(f)
+    if f.tell() != end:
+        options.report(logging.WARNING, "{0} at 0x{1:x}: parsed up to 0x{2:x} but the section ends at 0x{3:x}"
+                       .format(item.name, start, end, f.tell()))
+    else:
+        options.report(logging.INFO, "{0} at 0x{1:x}: 0x{2:x} bytes ok".format(item.name, start, end - start))
+    if mat1 is not None:
+        options.report(logging.INFO, "{0} materials".format(len(mat1.materials)))
+    f.seek(end)
+
+
 class Item(object):
     def __init__(self, name):
         self.name = name
@@ -180,7 +518,6 @@ class Item(object):
         resname = str(f.read(4), "ascii")
         item = cls(resname)
         item.name = resname
-        print(resname, "hey")
         size = read_uint32(f)
         item.data = f.read(size-8)
         return item 
@@ -202,9 +539,27 @@ class Item(object):
         item.data = unhexlify(obj["data"])
         return item 
 
+    # The item already is the section data, see ParseOptions.keep_source
+    def set_source(self, data):
+        pass
+
+    # Read-only copy for ScreenBlo.freeze
+    def frozen(self, pool):
+        return frozen_copy(self)
+
 
 class Pane(object):
+    # Generated from the section layout, subclasses set their own
+    codec = PANE_CODEC
+    # The section fields and the attributes below. Subclasses add the fields of their own codec.
+    __slots__ = PANE_CODEC.slots() + ("name", "child", "parent", "widget", "hide", "_source", "_dirty")
+
     def __init__(self):
+        # Section bytes the pane was parsed from (see ParseOptions.keep_source) and whether the pane was
+        # modified since
+        _set_attr(self, "_source", None)
+        _set_dirty(self, True)
+
         self.hide = False  # Not a blo feature, hides element in editor only
 
         self.name = "PAN2"
@@ -224,105 +579,104 @@ class Pane(object):
 
     @classmethod
     def from_file(cls, f):
-        start = f.tell()
         pane = cls()
-        pane.p_name = read_name(f)
-        if pane.p_name not in ("PAN2", "pan2"):
-            raise RuntimeError("Not a PAN2 or pan2 section but {}".format(pane.name))
-        size = read_uint32(f)
-        assert size == 0x48
-        unk = read_uint16(f)
-        assert unk == 0x40
-
-        pane.p_unk1 = read_uint16(f)  # 0xA
-        pane.p_enabled = read_uint8(f)  # 0xC
-        pane.p_anchor = read_uint8(f)  # 0xD
-        
-        re = f.read(2)
-        assert re == b"RE" or re == b"\x00\x00"
-        pane.p_panename = f.read(0x8).decode("ascii")
-        pane.p_secondaryname = f.read(0x8).decode("ascii")
-        #unknown = f.read(0x8)
-        #assert unknown == b"\x00"*8
-        pane.p_size_x = read_float(f)
-        pane.p_size_y = read_float(f)
-        pane.p_scale_x = read_float(f)
-        pane.p_scale_y = read_float(f)
-        unk = read_float(f)
-        assert unk == 0.0 
-        unk = read_float(f)
-        assert unk == 0.0 
-        
-        pane.p_rotation = read_float(f)
-        pane.p_offset_x = read_float(f)
-        pane.p_offset_y = read_float(f)
-        pane.p_unk4 = read_float(f)
-        
-        assert f.tell() == start + 0x48
+        cls.codec.unpack(pane, read_struct(f, cls.codec.struct))
         return pane
 
     def write(self, f, mat1):
-        start = f.tell()
-        write_name(f, self.p_name)
-        write_uint32(f, 0x48)
-        write_uint16(f, 0x40)
-
-        write_uint16(f, self.p_unk1)
-        write_uint8(f, self.p_enabled)
-        write_uint8(f, self.p_anchor)
-        f.write(b"RE")
-        f.write(bytes(self.p_panename, encoding="ascii"))
-        f.write(bytes(self.p_secondaryname, encoding="ascii"))
-
-        write_float(f, self.p_size_x)
-        write_float(f, self.p_size_y)
-        write_float(f, self.p_scale_x)
-        write_float(f, self.p_scale_y)
-
-        write_float(f, 0.0)
-        write_float(f, 0.0)
-
-        write_float(f, self.p_rotation)
-        write_float(f, self.p_offset_x)
-        write_float(f, self.p_offset_y)
-        write_float(f, self.p_unk4)
+        if self.write_source(f, mat1):
+            return
+        write_struct(f, self.codec.struct, *self.codec.pack(self))
+
+    # Setting any section field marks the pane as modified. Records assigned to it (window subdata,
+    # picture and textbox colors) mark it as modified when they are changed.
+    def __setattr__(self, name, value):
+        if name in self.codec.record_attributes:
+            value = self._adopt(name, value)
+        _set_attr(self, name, value)
+        if name[0] != "_" and name not in PANE_UNTRACKED_FIELDS:
+            _set_dirty(self, True)
+
+    # The value of a record attribute, owned by the pane. Dicts like the ones in the JSON files (or a list
+    # of them for the window subdata) become records and a textbox Color becomes a PaneColor.
+    def _adopt(self, name, value):
+        cls = self.codec.record_attributes[name]
+        if (name, ) in self.codec.types:
+            return self._adopt_record(name, cls, value)
+        if not isinstance(value, (list, tuple)):
+            raise TypeError("{0} has to be a list of {1}, not {2}".format(name, cls.__name__, type(value).__name__))
+        records = [self._adopt_record("an entry of " + name, cls, item) for item in value]
+        if isinstance(value, list) and all(record is item for record, item in zip(records, value)):
+            return value
+        return records
+
+    def _adopt_record(self, name, cls, value):
+        if isinstance(value, cls):
+            record = value
+        elif cls is PaneColor and isinstance(value, Color):
+            record = PaneColor(value.r, value.g, value.b, value.a)
+        elif issubclass(cls, SectionRecord) and isinstance(value, Mapping):
+            record = cls()
+            for key, item in value.items():
+                record[key] = item
+        else:
+            expected = "a Color" if cls is PaneColor else "a {0} or a dict".format(cls.__name__)
+            raise TypeError("{0} has to be {1}, not {2}".format(name, expected, type(value).__name__))
+        _set_attr(record, "_owner", self)
+        return record
+
+    # Called by the records and lists of the pane when they are changed in place
+    def mark_dirty(self):
+        self._dirty = True
+
+    # Read-only copy for ScreenBlo.freeze, which links it into the frozen tree
+    def frozen(self, pool):
+        pane = frozen_copy(self)
+        _set_attr(pane, "child", None)
+        _set_attr(pane, "parent", None)
+        _set_attr(pane, "widget", None)
+        return pane
 
-        assert f.tell() == start + 0x48
+    # The lists of the records (window subdata, the col1, col2 and unknowns of picture colors) are
+    # replaced with OwnedLists, so changing one of their entries in place marks the pane as modified
+    def set_source(self, data):
+        for name in self.codec.record_attributes:
+            value = getattr(self, name)
+            if isinstance(value, list):
+                value = OwnedList(value, self)
+                _set_attr(self, name, value)
+            for record in (value if isinstance(value, list) else (value, )):
+                for key in getattr(record, "_fields", ()):
+                    if isinstance(getattr(record, key), list):
+                        _set_attr(record, key, OwnedList(getattr(record, key), self))
+        self._source = data
+        self._dirty = False
+
+    # Write the original section bytes if the pane wasn't modified. Returns whether it did.
+    def write_source(self, f, mat1):
+        if self._source is None or self._dirty:
+            return False
+        f.write(self._source)
+        return True
+
+    # Indices of the materials in mat1 that this pane uses
+    def get_material_indices(self, mat1):
+        return []
+
+    # Update the pane's material indices after materials were removed, remap is a dict from old to new index
+    def remap_materials(self, remap):
+        pass
 
     def serialize(self):
-        result = {}
-        result["type"] = "PAN2"
-        result["p_type"] = self.p_name
-
-        for key, val in self.__dict__.items():
-            if key != "name" and key != "p_name" and key != "child" and key != "parent" and key != "widget" and key != "hide":
-                if isinstance(val, bytes):
-                    raise RuntimeError("hhhe")
-                result[key] = val
-        return result
+        return self.codec.to_dict(self)
 
     def assign_value(self, src, field):
-        self.__dict__[field] = src[field]
+        setattr(self, field, src[field])
 
     @classmethod
     def deserialize(cls, obj):
-        assert "p_type" in obj and obj["p_type"] in ("PAN2", "pan2")
         pane = cls()
-        pane.p_name = obj["p_type"]
-        pane.assign_value(obj, "p_unk1")
-        pane.assign_value(obj, "p_enabled")
-        pane.assign_value(obj, "p_anchor")
-        pane.assign_value(obj, "p_panename")
-        pane.assign_value(obj, "p_secondaryname")
-        pane.assign_value(obj, "p_size_x")
-        pane.assign_value(obj, "p_size_y")
-        pane.assign_value(obj, "p_scale_x")
-        pane.assign_value(obj, "p_scale_y")
-        pane.assign_value(obj, "p_rotation")
-        pane.assign_value(obj, "p_offset_x")
-        pane.assign_value(obj, "p_offset_y")
-        pane.assign_value(obj, "p_unk4")
-
+        cls.codec.from_dict(pane, obj)
         return pane
 
     def get_anchor_offset(self):
@@ -415,307 +769,126 @@ class Pane(object):
         self._set_middle(middle_x, middle_y)
 
 
+_set_dirty = Pane._dirty.__set__
+
+
 # Draw a window: 4 corner elements + side and one filling material
 class Window(Pane):
+    codec = WINDOW_CODEC
+    __slots__ = WINDOW_CODEC.slots(Pane.__slots__)
+
     def __init__(self):
         super().__init__()
         self.name = "WIN2"
 
-    @classmethod
-    def from_file(cls, f):
-        start = f.tell()
-        name = read_name(f)
-        size = read_uint32(f)
-        assert size == 0x90
-
-        if name != "WIN2":
-            raise RuntimeError("Not a WIN2 section")
-
-        window = super(Window, cls).from_file(f)
-        window.name = name
-
-        window.size = read_uint16(f)
-        reserved = f.read(6)
-        assert reserved == b"RESERV" or reserved == b"\x00"*7
-        window.padding = str(hexlify(f.read(8)), encoding="ascii")#.decode("ascii", errors="backslashreplace")
-        #assert window.padding == "\xFF"*8
-        window.subdata = [{}, {}, {}, {}]
-        for i in range(4):
-            window.subdata[i]["material"] = read_int16(f)
-        window.unkbyte1 = read_uint8(f)
-        window.unkbyte2 = read_uint8(f)
-        window.unk3 = read_uint16(f)
-        window.unk4 = read_uint16(f)
-        window.unk5 = read_uint16(f)
-        window.unk6 = read_uint16(f)
-        window.unk7 = read_uint16(f)
-        window.material = read_int16(f)
-        
-        re = f.read(2)
-        assert re == b"RE" or re == b"\x00\x00"
-        
-        for i in range(4):
-            window.subdata[i]["sub_unk2"] = read_uint16(f)
-        for i in range(4):
-            window.subdata[i]["sub_unk3"] = hex(read_uint32(f))
-        assert f.tell() == start+0x90
-        return window 
-
-    def write(self, f, mat1):
-        start = f.tell()
-        write_name(f, self.name)
-        write_uint32(f, 0x90)
-        super().write(f, mat1) # Write pane
-        write_uint16(f, self.size)
-
-        f.write(b"RESERV")
-        f.write(unhexlify(self.padding))
-        assert len(unhexlify(self.padding)) == 8
-        for i in range(4):
-            write_int16(f, self.subdata[i]["material"])
-
-        write_uint8(f, self.unkbyte1)
-        write_uint8(f, self.unkbyte2)
-        write_uint16(f, self.unk3)
-        write_uint16(f, self.unk4)
-        write_uint16(f, self.unk5)
-        write_uint16(f, self.unk6)
-        write_uint16(f, self.unk7)
-        write_int16(f, self.material)
-
-        f.write(b"RE")
-
-        for i in range(4):
-            write_uint16(f, self.subdata[i]["sub_unk2"])
-
-        for i in range(4):
-            write_uint32(f, int(self.subdata[i]["sub_unk3"], 16))
-
-        assert f.tell() == start + 0x90
-
-    def serialize(self):
-        result = super().serialize()
-        result["type"] = "WIN2"
-        
-        return result 
+    def get_material_indices(self, mat1):
+        return [self.material] + [subdata["material"] for subdata in self.subdata]
 
-    @classmethod
-    def deserialize(cls, obj):
-        assert "type" in obj and obj["type"] == "WIN2"
-        window = super(Window, cls).deserialize(obj)
-
-        window.assign_value(obj, "size")
-        window.assign_value(obj, "padding")
-        window.assign_value(obj, "subdata")
-        window.assign_value(obj, "unkbyte1")
-        window.assign_value(obj, "unkbyte2")
-        window.assign_value(obj, "unk3")
-        window.assign_value(obj, "unk4")
-        window.assign_value(obj, "unk5")
-        window.assign_value(obj, "unk6")
-        window.assign_value(obj, "unk7")
-        window.assign_value(obj, "material")
+    def remap_materials(self, remap):
+        self.material = remap.get(self.material, self.material)
+        for subdata in self.subdata:
+            subdata["material"] = remap.get(subdata["material"], subdata["material"])
 
+    def frozen(self, pool):
+        window = super().frozen(pool)
+        _set_attr(window, "subdata", tuple(subdata.frozen() for subdata in self.subdata))
         return window
 
 
 # Draw a texture in the GUI
 class Picture(Pane):
+    codec = PICTURE_CODEC
+    __slots__ = PICTURE_CODEC.slots(Pane.__slots__) + ("_material_index", )
+
     def __init__(self):
         super().__init__()
         self.name = "PIC2"
-    
+        self._material_index = None
+
     @classmethod
     def from_file(cls, f, mat1):
-        start = f.tell()
-        name = read_name(f)
-        size = read_uint32(f)
-        if name != "PIC2":
-            raise RuntimeError("Not a PIC2 section: {}".format(name))
-        picture = super(Picture, cls).from_file(f)
-        picture.name = name
-
-        picture.size = read_uint16(f)
-        picture.unk_index = read_uint16(f)
-        mat_index = read_uint16(f)
-        picture.material = mat1.materials[mat_index].name
-        
-        re = f.read(2)
-        assert re == b"RE" or re == b"\x00\x00"
-        color1 = {}
-        color2 = {}
-        
-        color1["unk1"] = read_uint16(f)
-        color1["unk2"] = read_uint16(f)
-        color2["unk1"] = read_uint16(f)
-        color2["unk2"] = read_uint16(f)
-        
-        color1["unknowns"] = [read_uint16(f) for x in range(4)]
-        color2["unknowns"] = [read_uint16(f) for x in range(4)]
-        color1["col1"] = [read_uint8(f) for x in range(4)]
-        color1["col2"] = [read_uint8(f) for x in range(4)]
-        color2["col1"] = [read_uint8(f) for x in range(4)]
-        color2["col2"] = [read_uint8(f) for x in range(4)]
-        
-        picture.color1 = color1 
-        picture.color2 = color2 
-        
-        assert f.tell() == start+0x80
-        return picture 
+        picture = cls()
+        mat_index, = cls.codec.unpack(picture, read_struct(f, cls.codec.struct))
+        picture.material = mat1.get_mat_name(mat_index)
+        picture._material_index = mat_index
+        return picture
 
     def write(self, f, mat1):
-        start = f.tell()
-        write_name(f, self.name)
-        write_uint32(f, 0x80)
-        super().write(f, mat1)  # Write pane
-        write_uint16(f, self.size)
-        write_uint16(f, self.unk_index)
-        write_uint16(f, mat1.get_mat_index(self.material))
-        f.write(b"RE")
-        write_uint16(f, self.color1["unk1"])
-        write_uint16(f, self.color1["unk2"])
-        write_uint16(f, self.color2["unk1"])
-        write_uint16(f, self.color2["unk2"])
-
-        for x in range(4):
-            write_uint16(f, self.color1["unknowns"][x])
-        for x in range(4):
-            write_uint16(f, self.color2["unknowns"][x])
-
-        for x in range(4):
-            write_uint8(f, self.color1["col1"][x])
-        for x in range(4):
-            write_uint8(f, self.color1["col2"][x])
-        for x in range(4):
-            write_uint8(f, self.color2["col1"][x])
-        for x in range(4):
-            write_uint8(f, self.color2["col2"][x])
-
-        assert f.tell() == start + 0x80
+        if self.write_source(f, mat1):
+            return
+        write_struct(f, self.codec.struct, *self.codec.pack(self, mat1.get_mat_index(self.material)))
 
-    def serialize(self):
-        result = super().serialize()
-        result["type"] = "PIC2"
-        
-        return result
+    # The section stores the material index, which changes if materials before it were added or removed
+    def write_source(self, f, mat1):
+        if self._source is None or mat1.get_mat_index(self.material) != self._material_index:
+            return False
+        return super().write_source(f, mat1)
 
-    @classmethod
-    def deserialize(cls, obj):
-        assert "type" in obj and obj["type"] == "PIC2"
-        window = super(Picture, cls).deserialize(obj)
+    # The material is stored by name, so removing other materials needs no remapping
+    def get_material_indices(self, mat1):
+        return [mat1.get_mat_index(self.material)]
 
-        window.assign_value(obj, "size")
-        window.assign_value(obj, "unk_index")
-        window.assign_value(obj, "material")
-        window.assign_value(obj, "color1")
-        window.assign_value(obj, "color2")
-
-        return window
+    def frozen(self, pool):
+        picture = super().frozen(pool)
+        _set_attr(picture, "color1", self.color1.frozen())
+        _set_attr(picture, "color2", self.color2.frozen())
+        return picture
 
 
 # Create text. Requires a material with font and an initialized font.
 class Textbox(Pane):
+    codec = TEXTBOX_CODEC
+    __slots__ = TEXTBOX_CODEC.slots(Pane.__slots__)
+
     def __init__(self):
         super().__init__()
         self.name = "TBX2"
-    
+
     @classmethod
     def from_file(cls, f):
         start = f.tell()
-        name = read_name(f)
-        size = read_uint32(f)
-
-        if name != "TBX2":
-            raise RuntimeError("Not a TBX2 section")
-        textbox = super(Textbox, cls).from_file(f)
-
-        textbox.size = read_uint16(f)
-        textbox.unk1 = read_uint16(f)
-        textbox.material = read_uint16(f)
-        textbox.signedunk3 = read_int16(f)
-        textbox.signedunk4 = read_int16(f)
-        textbox.unk5 = read_uint16(f)
-        textbox.unk6 = read_uint16(f)
-        textbox.unk7byte = read_uint8(f)
-        textbox.unk8byte = read_uint8(f)
-        textbox.color_top = Color.from_file(f)
-        textbox.color_bottom = Color.from_file(f)
-        textbox.unk11 = read_uint8(f)
-        res = f.read(3)
-        assert res == b"RES" or res == b"\x00\x00\x00"
-        textbox.text_cutoff = read_uint16(f)
-        stringlength = read_uint16(f)
-        assert f.tell() == start+0x70
+        textbox = cls()
+        size, stringlength = cls.codec.unpack(textbox, read_struct(f, cls.codec.struct))
         textbox.text = f.read(stringlength).decode("shift_jis_2004")
         f.seek(start+size)
         return textbox
 
     def write(self, f, mat1):
+        if self.write_source(f, mat1):
+            return
         start = f.tell()
-        write_name(f, self.name)
-        write_uint32(f, 0x70)
-        super().write(f, mat1)
-
-        write_uint16(f, self.size)
-        write_uint16(f, self.unk1)
-        write_uint16(f, self.material)
-        write_int16(f, self.signedunk3)
-        write_int16(f, self.signedunk4)
-        write_uint16(f, self.unk5)
-        write_uint16(f, self.unk6)
-        write_uint8(f, self.unk7byte)
-        write_uint8(f, self.unk8byte)
-        self.color_top.write(f)  #write_uint32(f, self.unk9)
-        self.color_bottom.write(f)  #write_uint32(f, self.unk10)
-        write_uint8(f, self.unk11)
-        f.write(b"RES")
-        write_uint16(f, self.text_cutoff)
-
         text = bytes(self.text, encoding="shift_jis_2004")
-        write_uint16(f, len(text))
-        assert f.tell() == start + 0x70
+        # Section size including the text padded to 8 bytes
+        size = ((start + self.codec.struct.size + len(text) + 7) & ~7) - start
+
+        write_struct(f, self.codec.struct, *self.codec.pack(self, size, len(text)))
         f.write(text)
         #f.write(b"\x00")
         write_pad(f, 8)
-        curr = f.tell()
-        f.seek(start+4)
-        write_uint32(f, curr-start)
-        f.seek(curr)
-    
-    def serialize(self):
-        result = super().serialize()
-        result["type"] = "TBX2"
-        result["color_top"] = self.color_top.serialize()
-        result["color_bottom"] = self.color_bottom.serialize()
 
-        return result
+    def get_material_indices(self, mat1):
+        return [self.material]
 
-    @classmethod
-    def deserialize(cls, obj):
-        assert "type" in obj and obj["type"] == "TBX2"
-        window = super(Textbox, cls).deserialize(obj)
-
-        window.assign_value(obj, "size")
-        window.assign_value(obj, "unk1")
-        window.assign_value(obj, "material")
-        window.assign_value(obj, "signedunk3")
-        window.assign_value(obj, "signedunk4")
-        window.assign_value(obj, "unk5")
-        window.assign_value(obj, "unk6")
-        window.assign_value(obj, "unk7byte")
-        window.assign_value(obj, "unk8byte")
-        #window.assign_value(obj, "unk9")
-        window.color_top = Color.deserialize(obj["color_top"])  #window.assign_value(obj, "unk10")
-        window.color_bottom = Color.deserialize(obj["color_bottom"])
-        window.assign_value(obj, "unk11")
-        window.assign_value(obj, "text_cutoff")
-
-        window.assign_value(obj, "text")
+    def remap_materials(self, remap):
+        self.material = remap.get(self.material, self.material)
+
+    def frozen(self, pool):
+        textbox = super().frozen(pool)
+        for name in ("color_top", "color_bottom"):
+            color = getattr(self, name)
+            _set_attr(textbox, name, pool.intern(Color(color.r, color.g, color.b, color.a)))
+        return textbox
 
-        return window
+
+# Let the codecs assign the pane slots directly
+for cls in (Pane, Window, Picture, Textbox):
+    cls.codec.bind(cls)
 
 
 class ResourceReference(Item):
+    _source = None
+    _index = None  # reference -> index of its first occurrence, see get_index
+
     def __init__(self):
         super().__init__(self.ResName())
         self.references = []
@@ -758,41 +931,105 @@ class ResourceReference(Item):
         f.seek(start+size)
         return resreference
 
+    # Keep the original section bytes, they are written back as long as the references are unchanged
+    def set_source(self, data):
+        self._source = data
+        self._source_references = list(self.references)
+
     def write(self, f):
+        if self._source is not None and self.references == self._source_references:
+            f.write(self._source)
+            return
         start = f.tell()
-        f.write(bytes(self.ResName(), encoding="ascii"))
-        f.write(b"ABCD")
-        write_uint16(f, len(self.references))
-        f.write(b"\xFF\xFF")
-        write_uint32(f, 0x10)
-        offsets = {}
-        namestart = f.tell()
-        write_uint16(f, len(self.references))
-        f.write(b"\xAB\xCD"*len(self.references))
-        #write_pad(f, 2)
 
+        # Lay out the names first so the offset table and the section size are known before writing
+        offsets = {}
+        names = []
+        namesize = 2 + len(self.references)*2
         for ref in self.references:
             if ref not in offsets:
-                offsets[ref] = f.tell()-namestart
-                write_uint8(f, 0x2)
-                write_uint8(f, len(ref))
-                f.write(bytes(ref, encoding="shift_jis_2004"))
+                offsets[ref] = namesize
+                name = bytes(ref, encoding="shift_jis_2004")
+                names.append(struct.pack(">BB", 0x2, len(ref)) + name)
+                namesize += 2 + len(name)
                 #write_pad(f, 4)
+        size = ((start + RESOURCE_HEADER_STRUCT.size + namesize + 0x1F) & ~0x1F) - start
+
+        write_struct(f, RESOURCE_HEADER_STRUCT, bytes(self.ResName(), encoding="ascii"), size,
+                     len(self.references), 0xFFFF, 0x10)
+        f.write(struct.pack(">{0}H".format(len(self.references)+1), len(self.references),
+                            *[offsets[ref] for ref in self.references]))
+        f.write(b"".join(names))
         write_pad(f, 0x20)
-        curr = f.tell()
-        f.seek(namestart+2)
-        for ref in self.references:
-            offset = offsets[ref]
-            write_uint16(f, offset)
 
+    # Index of the first reference equal to name, or None. The lookup table is rebuilt when the list was
+    # replaced or its length changed, when the found reference doesn't match, and once on a miss.
+    def get_index(self, name):
+        i = self._lookup(name)
+        if i is None and not is_frozen(self):
+            i = self._build_index()[2].get(name)
+        return i
+
+    # Like get_index, but a miss appends name without rebuilding the table first, which keeps adding many
+    # references linear. A reference replaced in place (references[i] = name) is only found by
+    # get_index_or_add after a get_index call or with a new list.
+    def get_index_or_add(self, name):
+        i = self._lookup(name)
+        if i is None:
+            self.references.append(name)
+            i = len(self.references) - 1
+            self._index = (self.references, len(self.references), self._index[2])
+            self._index[2][name] = i
+        return i
+
+    # Table lookup without the rebuild on a miss
+    def _lookup(self, name):
+        index = self._index
+        if is_frozen(self):
+            return index[2].get(name)
+        if index is None or index[0] is not self.references or index[1] != len(self.references):
+            index = self._build_index()
+
+        i = index[2].get(name)
+        if i is not None and self.references[i] != name:
+            i = self._build_index()[2].get(name)
+        return i
+
+    def _build_index(self):
+        names = {}
+        for i, ref in enumerate(self.references):
+            names.setdefault(ref, i)
+        self._index = (self.references, len(self.references), names)
+        return self._index
+
+    def frozen(self, pool):
+        resreference = frozen_copy(self)
+        references = tuple(self.references)
+        _set_attr(resreference, "references", references)
+        if self._source is not None:
+            _set_attr(resreference, "_source_references", tuple(self._source_references))
+        names = {}
+        for i, ref in enumerate(references):
+            names.setdefault(ref, i)
+        _set_attr(resreference, "_index", (references, len(references), names))
+        return resreference
+
+    # Remove every reference whose index isn't in used.
+    # Returns a dict from the old index of each kept reference to its new index.
+    def remove_unused(self, used):
+        remap = {}
+        references = []
+        for i, ref in enumerate(self.references):
+            if i in used:
+                remap[i] = len(references)
+                references.append(ref)
+        self.references = references
 
-        f.seek(start+4)
-        write_uint32(f, curr-start)
-        f.seek(curr)
+        return remap
 
     def serialize(self):
         result = {"type": self.ResName()}
-        result["references"] = self.references 
+        result["references"] = list(self.references)
         
         return result
 
@@ -824,53 +1061,119 @@ class Information(object):
     
     @classmethod 
     def from_file(cls, f):
-        if f.read(4) != b"INF1":
-            raise RuntimeError("Not an INF1 section!")
-        
-        size = read_uint32(f)
-        assert size == 0x20
-        width = read_uint16(f)
-        height = read_uint16(f)
-        inf = cls(width, height)
-        inf.val1 = read_uint8(f)
-        inf.val2 = read_uint8(f)
-        inf.val3 = read_uint8(f)
-        inf.val4 = read_uint8(f)
-        f.read(size-0x10) # Padding
+        inf = cls(0, 0)
+        INFORMATION_CODEC.unpack(inf, read_struct(f, INFORMATION_CODEC.struct))
+        f.read(0x10) # Padding
         
         return inf 
     
     def write(self, f):
-        f.write(b"INF1")
-        write_uint32(f, 0x20)
-        write_uint16(f, self.width)
-        write_uint16(f, self.height)
-        write_uint8(f, self.val1)
-        write_uint8(f, self.val2)
-        write_uint8(f, self.val3)
-        write_uint8(f, self.val4)
+        write_struct(f, INFORMATION_CODEC.struct, *INFORMATION_CODEC.pack(self))
         write_pad(f, 0x20)
         
     def serialize(self):
-        result = {}
-        result["type"] = "INF1"
-        result["width"] = self.width 
-        result["height"] = self.height 
-        result["values"] = [self.val1, self.val2, self.val3, self.val4]
-        
-        return result 
+        return INFORMATION_CODEC.to_dict(self)
+
+    # Read-only copy for ScreenBlo.freeze
+    def frozen(self, pool):
+        return frozen_copy(self)
         
     @classmethod
     def deserialize(cls, obj):
-        assert obj["type"] == "INF1"
-        info = cls(obj["width"], obj["height"])
-        info.val1 = obj["values"][0]
-        info.val2 = obj["values"][1]
-        info.val3 = obj["values"][2]
-        info.val4 = obj["values"][3]
-        
-        return info 
-        
+        info = cls(0, 0)
+        INFORMATION_CODEC.from_dict(info, obj)
+
+        return info
+
+
+# Decodes one type of section for Node.iter_events and Node.iter_serialized_events.
+# read and deserialize return the (event, item) tuple to yield, see ScreenBlo.iter_events.
+class SectionHandler(object):
+    def __init__(self, event, cls):
+        self.event = event
+        self.cls = cls
+
+    def read(self, f, materials, options):
+        return self.event, self.cls.from_file(f)
+
+    def deserialize(self, obj, textures):
+        return self.event, self.cls.deserialize(obj)
+
+
+class PictureHandler(SectionHandler):
+    def read(self, f, materials, options):
+        return self.event, self.cls.from_file(f, materials)
+
+
+class MaterialsHandler(SectionHandler):
+    def read(self, f, materials, options):
+        return self.event, self.cls.from_file(f, options)
+
+    def deserialize(self, obj, textures):
+        return self.event, self.cls.preprocess_deserialize(obj, textures)
+
+
+# Keeps the section undecoded as an Item, which is written back and serialized as its raw data.
+# Child panes of a raw section are still read and attached to it. Pictures need the MAT1 in scope
+# to resolve their material, so a raw MAT1 needs raw PIC2 sections too.
+class RawSectionHandler(SectionHandler):
+    def __init__(self):
+        super().__init__("raw", Item)
+
+
+# Moves past the section without reading it, it doesn't show up in the events or the node tree.
+# The BGN1/END1 block of child panes following a skipped section is skipped as a whole.
+class SkipSectionHandler(SectionHandler):
+    def __init__(self):
+        super().__init__(None, None)
+
+    def read(self, f, materials, options):
+        start = f.tell()
+        f.read(4)
+        f.seek(start + read_uint32(f))
+        return None, None
+
+    def deserialize(self, obj, textures):
+        return None, None
+
+
+RAW_SECTION = RawSectionHandler()
+SKIP_SECTION = SkipSectionHandler()
+
+# Handlers of the sections following INF1, by the magic in the file and by the type in the JSON dict
+SECTION_HANDLERS = {}
+SERIALIZED_HANDLERS = {}
+
+
+# Register the handler for a section magic, replacing the current one. For a single parse
+# use ParseOptions.sections instead.
+def register_section(magic, handler):
+    SECTION_HANDLERS[bytes(magic, encoding="ascii")] = handler
+    SERIALIZED_HANDLERS[magic] = handler
+
+
+register_section("TEX1", SectionHandler("textures", TextureNames))
+register_section("FNT1", SectionHandler("fonts", FontNames))
+register_section("MAT1", MaterialsHandler("materials", MAT1))
+register_section("PAN2", SectionHandler("pane", Pane))
+register_section("WIN2", SectionHandler("pane", Window))
+register_section("PIC2", PictureHandler("pane", Picture))
+register_section("TBX2", SectionHandler("pane", Textbox))
+
+
+# The (file, serialized) handler tables with the overrides of ParseOptions.sections applied
+def get_section_handlers(options):
+    if not options.sections:
+        return SECTION_HANDLERS, SERIALIZED_HANDLERS
+
+    handlers = dict(SECTION_HANDLERS)
+    serialized_handlers = dict(SERIALIZED_HANDLERS)
+    for magic, handler in options.sections.items():
+        handlers[bytes(magic, encoding="ascii")] = handler
+        serialized_handlers[magic] = handler
+    return handlers, serialized_handlers
+
+
         
 class ScreenBlo(object):
     def __init__(self):
@@ -882,7 +1185,7 @@ class ScreenBlo(object):
         self.root.print_hierarchy(4)
         
     @classmethod 
-    def from_file(cls, f):
+    def from_file(cls, f, options=None):
         magic = f.read(8)
         if magic != b"SCRNblo2":
             raise RuntimeError("Unsupported magic: {0}".format(magic))
@@ -895,28 +1198,204 @@ class ScreenBlo(object):
         blo = cls()
         blo.info = Information.from_file(f)
         
-        blo.root = Node.from_file(f)
+        blo.root = Node.from_file(f, options=options)
 
         return blo
 
-    def write(self, f):
+    # Parse from bytes, bytearray, memoryview, mmap or io.BytesIO without going through a file
+    @classmethod
+    def from_buffer(cls, data, offset=0, options=None):
+        return cls.from_file(BufferReader(data, offset), options)
+
+    # Parse the file as a stream of (event, item) tuples without building the node tree:
+    #   ("info", Information)
+    #   ("textures", TextureNames), ("fonts", FontNames), ("materials", MAT1)
+    #   ("pane", Pane/Window/Picture/Textbox)
+    #   ("enter_child", pane) and ("exit_child", pane) for the BGN1/END1 block of child panes following a pane
+    # Nothing is kept except the MAT1 in scope, which pictures need to resolve their material name.
+    @classmethod
+    def iter_events(cls, f, options=None):
+        if options is None:
+            options = ParseOptions()
+
+        magic = f.read(8)
+        if magic != b"SCRNblo2":
+            raise RuntimeError("Unsupported magic: {0}".format(magic))
+        total_size = read_uint32(f)
+        count = read_uint32(f)
+        svr = f.read(0x10) # ignored
+
+        yield "info", Information.from_file(f)
+
+        for event in Node.iter_events(f, options=options):
+            yield event
+
+    # List the sections of a file by walking only the section headers, nothing else is decoded
+    @classmethod
+    def scan_sections(cls, f):
         start = f.tell()
-        f.write(b"SCRNblo2")
-        f.write(b"ABCD0123")  # placeholder for size + count
-        f.write(b"SVR1")
-        f.write(b"\xFF"*12)
-
-        self.info.write(f)
-        count = self.root.write(f)
-        f.write(b"EXT1")
-        write_uint32(f, 0x8)
-        write_pad(f, 0x20)
-        curr = f.tell()
+        magic = f.read(8)
+        if magic != b"SCRNblo2":
+            raise RuntimeError("Unsupported magic: {0}".format(magic))
 
-        f.seek(0x8)
-        write_uint32(f, curr-start)
-        write_uint32(f, count+2)  # Add in INF and EXT section
-        f.seek(curr)
+        sections = []
+        offset = start + FILE_HEADER_SIZE
+        depth = 0
+        last_pane = -1
+        parents = [-1]  # Pane owning the current BGN1/END1 block
+
+        while True:
+            f.seek(offset)
+            header = f.read(SECTION_HEADER_STRUCT.size)
+            if len(header) < SECTION_HEADER_STRUCT.size:
+                raise RuntimeError("malformed file?")
+            magic, size = SECTION_HEADER_STRUCT.unpack(header)
+            magic = magic.decode("ascii")
+            if size < SECTION_HEADER_STRUCT.size:
+                raise RuntimeError("Bad size for {0} section at 0x{1:x}".format(magic, offset))
+
+            if magic == "END1":
+                depth -= 1
+                parents.pop()
+            section = SectionInfo(magic, offset - start, size, depth, parents[-1])
+
+            if magic == "BGN1":
+                parents.append(last_pane)
+                depth += 1
+            elif magic in PANE_NAME_OFFSETS:
+                f.seek(offset + PANE_NAME_OFFSETS[magic])
+                section.panename = f.read(8).decode("ascii")
+                last_pane = len(sections)
+
+            sections.append(section)
+            if magic == "EXT1":
+                break
+            offset += size
+
+        return sections
+
+    # Decode a single section found with scan_sections. f has to be positioned at the start of the file,
+    # Pictures need the MAT1 of the file to resolve their material.
+    @classmethod
+    def read_section(cls, f, section, materials=None, options=None):
+        start = f.tell()
+        f.seek(start + section.offset)
+
+        if section.magic == "INF1":
+            item = Information.from_file(f)
+        else:
+            if options is None:
+                options = ParseOptions()
+            handler = get_section_handlers(options)[0].get(bytes(section.magic, encoding="ascii"), RAW_SECTION)
+            event, item = handler.read(f, materials, options)
+
+        f.seek(start)
+        return item
+
+    # The file is built in memory and written to f with a single write, so f can be any writable
+    # stream including pipes and sys.stdout.buffer.
+    # With prune, unused materials, textures and fonts are removed from the layout first, see prune_resources.
+    def write(self, f, prune=False):
+        if prune:
+            self.prune_resources()
+        self.build().flush_to(f)
+
+    # Remove the materials that no pane uses, then the TEX1 and FNT1 references that no remaining
+    # material uses, and remap every index pointing at them. This modifies the layout in place.
+    # Returns the number of removed materials, textures and fonts.
+    def prune_resources(self):
+        # Resources are scoped to BGN1/END1 blocks the same way as when parsing
+        scopes = []
+        textures = fonts = materials = None
+        mat1s = {}  # id(MAT1) -> [MAT1, TEX1 in scope, FNT1 in scope, used material indices]
+        panes = []  # (pane, MAT1 in scope)
+
+        for event, item, node, depth in self.root.walk():
+            if event == "enter":
+                scopes.append((textures, fonts, materials))
+            elif event == "exit":
+                textures, fonts, materials = scopes.pop()
+            elif isinstance(item, TextureNames):
+                textures = item
+            elif isinstance(item, FontNames):
+                fonts = item
+            elif isinstance(item, MAT1):
+                materials = item
+                mat1s[id(item)] = [item, textures, fonts, set()]
+            elif isinstance(item, Pane) and materials is not None:
+                panes.append((item, materials))
+                mat1s[id(materials)][3].update(item.get_material_indices(materials))
+
+        removed_materials = 0
+        for mat1, textures, fonts, used in mat1s.values():
+            count = len(mat1.materials)
+            remap = mat1.remove_unused(used)
+            if len(remap) < count:
+                removed_materials += count - len(remap)
+                for pane, materials in panes:
+                    if materials is mat1:
+                        pane.remap_materials(remap)
+
+        # A TEX1 or FNT1 can be shared by several MAT1 sections
+        used_textures = {}
+        used_fonts = {}
+        for mat1, textures, fonts, used in mat1s.values():
+            if textures is not None:
+                used = used_textures.setdefault(id(textures), (textures, set()))[1]
+                for material in mat1.materials:
+                    used.update(index for index in material.textures if index is not None)
+            if fonts is not None:
+                used = used_fonts.setdefault(id(fonts), (fonts, set()))[1]
+                for material in mat1.materials:
+                    if material.font is not None:
+                        used.add(struct.unpack(">H", material.font.data)[0])
+
+        removed_textures = 0
+        for textures, used in used_textures.values():
+            count = len(textures.references)
+            remap = textures.remove_unused(used)
+            removed_textures += count - len(remap)
+            for mat1, mat1_textures, fonts, used in mat1s.values():
+                if mat1_textures is textures and len(remap) < count:
+                    for material in mat1.materials:
+                        material.textures = [remap.get(index, index) if index is not None else None
+                                             for index in material.textures]
+
+        removed_fonts = 0
+        for fonts, used in used_fonts.values():
+            count = len(fonts.references)
+            remap = fonts.remove_unused(used)
+            removed_fonts += count - len(remap)
+            for mat1, textures, mat1_fonts, used in mat1s.values():
+                if mat1_fonts is fonts and len(remap) < count:
+                    for material in mat1.materials:
+                        if material.font is not None:
+                            index = struct.unpack(">H", material.font.data)[0]
+                            font = FontNumber(material.font.index)
+                            font.data = struct.pack(">H", remap.get(index, index))
+                            material.font = font
+
+        return removed_materials, removed_textures, removed_fonts
+
+    def to_bytes(self):
+        return self.build().getvalue()
+
+    # The whole file in a BufferWriter
+    def build(self):
+        out = BufferWriter()
+        write_struct(out, FILE_HEADER_STRUCT, b"SCRNblo2", 0, 0)  # size and count are filled in at the end
+        out.write(b"SVR1")
+        out.write(b"\xFF"*12)
+
+        self.info.write(out)
+        count = self.root.write(out)
+        out.write(b"EXT1")
+        write_uint32(out, 0x8)
+        write_pad(out, 0x20)
+
+        patch_struct(out, FILE_HEADER_STRUCT, 0, b"SCRNblo2", out.tell(), count+2)  # Add in INF and EXT section
+
+        return out
 
     def serialize(self):
         result = []
@@ -926,14 +1405,123 @@ class ScreenBlo(object):
         return result
 
     @classmethod
-    def deserialize(cls, obj):
+    def deserialize(cls, obj, options=None):
         blo = cls()
         assert obj[0]["type"] == "INF1"
         blo.info = Information.deserialize(obj[0])
-        blo.root = Node.deserialize(obj[1])
+        blo.root = Node.deserialize(obj[1], options=options)
 
         return blo
 
+    # Immutable snapshot of the layout, see FrozenScreenBlo. Material sub-records and colors are shared
+    # through pool (by default a new InternPool), reuse one pool to share them between snapshots.
+    # The layout itself stays editable.
+    def freeze(self, pool=None):
+        if pool is None:
+            pool = InternPool()
+        return FrozenScreenBlo(self.info.frozen(pool), self.root.freeze(pool))
+
+
+# Read-only snapshot of a layout made with ScreenBlo.freeze. Nodes hold their children in tuples and the
+# panes, materials and resources are frozen copies, setting any of their attributes raises an AttributeError.
+# Reading, serializing and writing work like on the layout and need no locking, so a snapshot can be
+# shared between threads. Snapshots hash and compare by their file bytes, which makes them usable as
+# cache keys. To edit a snapshot, parse its bytes again with ScreenBlo.from_buffer.
+class FrozenScreenBlo(ScreenBlo):
+    def __init__(self, info, root):
+        _set_attr(self, "info", info)
+        _set_attr(self, "root", root)
+        _set_attr(self, "_bytes", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("A FrozenScreenBlo can't be modified, edit the layout it was made from "
+                             "and freeze it again")
+
+    def __delattr__(self, name):
+        self.__setattr__(name, None)
+
+    def freeze(self, pool=None):
+        return self
+
+    def prune_resources(self):
+        raise RuntimeError("A FrozenScreenBlo can't be pruned, prune the layout before freezing it")
+
+    # The bytes are built on first use. Threads doing it at the same time build the same bytes,
+    # so whichever result is kept doesn't matter.
+    def to_bytes(self):
+        if self._bytes is None:
+            _set_attr(self, "_bytes", super().to_bytes())
+        return self._bytes
+
+    # Writes the kept bytes instead of building the file again
+    def write(self, f, prune=False):
+        if prune:
+            self.prune_resources()
+        f.write(self.to_bytes())
+
+    def __hash__(self):
+        return hash(self.to_bytes())
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        return isinstance(other, FrozenScreenBlo) and self.to_bytes() == other.to_bytes()
+
+
+class SectionInfo(object):
+    def __init__(self, magic, offset, size, depth, parent=-1, panename=None):
+        self.magic = magic
+        self.offset = offset  # From the start of the file
+        self.size = size
+        self.depth = depth  # BGN1/END1 nesting level
+        self.parent = parent  # Index of the pane whose BGN1/END1 block contains this section, -1 for top level
+        self.panename = panename
+
+    def serialize(self):
+        return [self.magic, self.offset, self.size, self.depth, self.parent, self.panename]
+
+    @classmethod
+    def deserialize(cls, obj):
+        return cls(*obj)
+
+
+# Section list of a .blo file, cached in a .blo.idx sidecar file next to it. The sidecar is keyed
+# on the file's mtime and size and is rebuilt with ScreenBlo.scan_sections when they don't match.
+def load_section_index(path, write_sidecar=True):
+    stat = os.stat(path)
+    key = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+    index_path = path + ".idx"
+
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index["mtime_ns"] == key["mtime_ns"] and index["size"] == key["size"]:
+            return [SectionInfo.deserialize(section) for section in index["sections"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    with open(path, "rb") as f:
+        sections = ScreenBlo.scan_sections(f)
+
+    if write_sidecar:
+        index = dict(key)
+        index["sections"] = [section.serialize() for section in sections]
+        # A temporary file of its own for every writer, so processes and threads indexing the same file
+        # at the same time don't collide. The last one to finish replaces the sidecar.
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=os.path.dirname(index_path) or ".",
+                                         prefix=os.path.basename(index_path) + ".", suffix=".tmp",
+                                         delete=False) as f:
+            tmp_path = f.name
+            try:
+                json.dump(index, f, ensure_ascii=False)
+            except BaseException:
+                f.close()
+                os.remove(tmp_path)
+                raise
+        os.replace(tmp_path, index_path)
+
+    return sections
+
 
 if __name__ == "__main__":
     """
@@ -963,7 +1551,7 @@ if __name__ == "__main__":
         if outfile is None:
             outfile = inputfile+".json"
         with open(inputfile, "rb") as f:
-            blo = ScreenBlo.from_file(f)
+            blo = ScreenBlo.from_buffer(f.read())
 
         with open(outfile, "w", encoding="utf-8") as f:
             json.dump(blo.serialize(), f, indent=4, ensure_ascii=False)
@@ -974,8 +1562,11 @@ if __name__ == "__main__":
         with open(inputfile, "r", encoding="utf-8") as f:
             blo = ScreenBlo.deserialize(json.load(f))
 
-        with open(outfile, "wb") as f:
-            blo.write(f)
+        if outfile == "-":
+            blo.write(sys.stdout.buffer)
+        else:
+            with open(outfile, "wb") as f:
+                blo.write(f)
 
 
     """inputfile = "cave_pikmin.blo"
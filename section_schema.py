@@ -0,0 +1,265 @@
+import struct
+from types import MemberDescriptorType
+from binascii import hexlify, unhexlify
+
+
+# Declarative section layouts. A layout is a list of the entries below in the order they are stored
+# in the file. SectionCodec turns a layout into a struct and generates the functions that convert
+# between the struct values, the object attributes and the JSON dict once, when it is created.
+
+# Conversions between the value stored in the file and the attribute value,
+# as (read, write) expression templates
+ASCII = ('{0}.decode("ascii")', 'bytes({0}, encoding="ascii")')
+HEX = ('str(hexlify({0}), encoding="ascii")', "unhexlify({0})")
+HEX_INT = ("hex({0})", "int({0}, 16)")
+
+
+# A value stored in an attribute. attr is the attribute name, or a path like ("subdata", 0, "material")
+# for a value inside a list, dict or object held by the attribute. key is the path of the value in the
+# JSON dict if it's different from attr. conv converts between the file and the attribute value,
+# json_conv between the attribute and the JSON value. With choices, reading or deserializing any
+# other value fails.
+class Field(object):
+    def __init__(self, attr, fmt, conv=None, key=None, choices=None, error=None, json_conv=None):
+        self.attr = attr if isinstance(attr, tuple) else (attr, )
+        self.fmt = fmt
+        self.conv = conv
+        self.json_conv = json_conv
+        self.key = self.attr if key is None else (key if isinstance(key, tuple) else (key, ))
+        self.choices = choices
+        self.error = error
+
+
+# A value that is always written the same. Reading any value not in accepted raises a RuntimeError
+# with the error message (formatted with the value) or fails an assert if there is no message.
+class Const(object):
+    def __init__(self, value, fmt, accepted=None, error=None):
+        self.value = value
+        self.fmt = fmt
+        self.accepted = accepted if accepted is not None else (value, )
+        self.error = error
+
+
+# A value the section code handles itself, e.g. a size or an index that needs other sections to resolve.
+# unpack returns the Arg values in layout order and pack takes them as arguments.
+class Arg(object):
+    def __init__(self, name, fmt):
+        self.name = name
+        self.fmt = fmt
+
+
+# An attribute that isn't part of the struct but is serialized at this position, e.g. a trailing string
+class Extra(object):
+    def __init__(self, attr):
+        self.attr = (attr, )
+        self.key = self.attr
+        self.fmt = ""
+        self.json_conv = None
+
+
+def _fixed(value, size):
+    assert len(value) == size
+    return value
+
+
+# Build the source of a nested value from (path, expression) pairs. Paths with int keys become
+# lists, paths with str keys become dicts, or objects created with keyword arguments if the path
+# is in types. The objects also get owner=obj, the object holding them.
+def _nested_source(items, types, prefix=()):
+    children = {}
+    for path, expr in items:
+        children.setdefault(path[0], []).append((path[1:], expr))
+
+    sources = []
+    for key, subitems in children.items():
+        if len(subitems) == 1 and subitems[0][0] == ():
+            source = subitems[0][1]
+        else:
+            source = _nested_source(subitems, types, prefix + (key, ))
+        sources.append((key, source))
+
+    if prefix in types:
+        arguments = ["{0}={1}".format(key, source) for key, source in sources] + ["owner=obj"]
+        return "{0}({1})".format(types[prefix].__name__, ", ".join(arguments))
+    elif all(isinstance(key, int) for key, source in sources):
+        return "[{0}]".format(", ".join(source for key, source in sorted(sources)))
+    else:
+        return "{{{0}}}".format(", ".join("{0!r}: {1}".format(key, source) for key, source in sources))
+
+
+def _attr_source(path, types):
+    source = "obj." + path[0]
+    for i in range(1, len(path)):
+        if path[:i] in types:
+            source += "." + path[i]
+        else:
+            source += "[{0!r}]".format(path[i])
+    return source
+
+
+def _key_source(path):
+    return "d" + "".join("[{0!r}]".format(key) for key in path)
+
+
+class SectionCodec(object):
+    # json_type is the "type" entry of the JSON dict. order lists JSON keys that come first, the
+    # other keys follow in layout order. types maps attribute paths to the classes holding their values,
+    # which take the object they belong to as owner argument.
+    def __init__(self, layout, json_type, order=(), types=None):
+        self.layout = layout
+        self.json_type = json_type
+        self.types = types if types is not None else {}
+        self.struct = struct.Struct(">" + "".join(entry.fmt for entry in layout))
+
+        fields = [entry for entry in layout if isinstance(entry, (Field, Extra))]
+        keys = list(order)
+        for field in fields:
+            if field.key[0] not in keys:
+                keys.append(field.key[0])
+        self.fields = sorted(fields, key=lambda field: keys.index(field.key[0]))
+
+        # Top level attributes in layout order
+        self.attributes = []
+        for field in fields:
+            if field.attr[0] not in self.attributes:
+                self.attributes.append(field.attr[0])
+        self.attributes = tuple(self.attributes)
+        # Top level attributes holding objects of types or lists of them -> their class
+        self.record_attributes = {path[0]: cls for path, cls in self.types.items()}
+
+        self.cls = None
+        self._compile()
+
+    # Generate the functions again for a class with __slots__, so they assign the slots through their
+    # descriptors instead of object.__setattr__
+    def bind(self, cls):
+        self.cls = cls
+        self._compile()
+
+    def _compile(self):
+        namespace = {"hexlify": hexlify, "unhexlify": unhexlify, "_fixed": _fixed, "_set": object.__setattr__}
+        for cls in self.types.values():
+            namespace[cls.__name__] = cls
+        for attr in self.attributes:
+            if isinstance(getattr(self.cls, attr, None), MemberDescriptorType):
+                namespace["_set_" + attr] = getattr(self.cls, attr).__set__
+
+        self.source = "\n".join((self._unpack_source(), self._pack_source(),
+                                 self._to_dict_source(), self._from_dict_source()))
+        exec(self.source, namespace)
+
+        # The functions assign the attributes bypassing any __setattr__ of the class
+        # unpack(obj, values): assign the attributes from the struct values, returns the Arg values
+        self.unpack = namespace["unpack"]
+        # pack(obj, *args): struct values from the attributes and the Arg values
+        self.pack = namespace["pack"]
+        # to_dict(obj): JSON dict of the attributes
+        self.to_dict = namespace["to_dict"]
+        # from_dict(obj, d): assign the attributes from a JSON dict
+        self.from_dict = namespace["from_dict"]
+
+    # __slots__ for a class using this codec, without the attributes already in the base class slots
+    def slots(self, base=()):
+        return tuple(attr for attr in self.attributes if attr not in base)
+
+    def _assign_source(self, attr, source):
+        if isinstance(getattr(self.cls, attr, None), MemberDescriptorType):
+            return "_set_{0}(obj, {1})".format(attr, source)
+        return "_set(obj, {0!r}, {1})".format(attr, source)
+
+    # Layout entries with a struct value, every entry has exactly one
+    def _values(self):
+        return [entry for entry in self.layout if not isinstance(entry, Extra)]
+
+    def _unpack_source(self):
+        lines = ["def unpack(obj, values):"]
+        names = []
+        attributes = {}
+        args = []
+        for i, entry in enumerate(self._values()):
+            names.append("v{0}".format(i))
+            value = names[-1]
+            if isinstance(entry, Const):
+                if entry.error is None:
+                    lines.append("    assert {0} in {1!r}".format(value, entry.accepted))
+                else:
+                    lines.append("    if {0} not in {1!r}:".format(value, entry.accepted))
+                    lines.append("        raise RuntimeError({0!r}.format({1}))".format(entry.error, value))
+            elif isinstance(entry, Arg):
+                args.append(value)
+            else:
+                if entry.conv is not None:
+                    value = entry.conv[0].format(value)
+                if entry.choices is not None:
+                    lines.append("    {0} = {1}".format(names[-1], value))
+                    value = names[-1]
+                    lines.append("    if {0} not in {1!r}:".format(value, entry.choices))
+                    lines.append("        raise RuntimeError({0!r}.format({1}))".format(entry.error, value))
+                attributes[entry.attr] = value
+
+        lines.insert(1, "    {0}, = values".format(", ".join(names)))
+        items = [(field.attr, attributes[field.attr]) for field in self.fields if field.attr in attributes]
+        for attr, source in self._top_level(items, self.types):
+            lines.append("    " + self._assign_source(attr, source))
+        lines.append("    return ({0})".format("".join(arg + ", " for arg in args)))
+        return "\n".join(lines) + "\n"
+
+    def _pack_source(self):
+        args = [entry.name for entry in self.layout if isinstance(entry, Arg)]
+        values = []
+        for entry in self._values():
+            if isinstance(entry, Const):
+                values.append(repr(entry.value))
+            elif isinstance(entry, Arg):
+                values.append(entry.name)
+            else:
+                value = _attr_source(entry.attr, self.types)
+                if entry.conv is not None:
+                    value = entry.conv[1].format(value)
+                if entry.fmt.endswith("s"):
+                    value = "_fixed({0}, {1})".format(value, struct.calcsize(entry.fmt))
+                values.append(value)
+
+        return "def pack(obj{0}):\n    return ({1}, )\n".format(
+            "".join(", " + arg for arg in args), ", ".join(values))
+
+    def _to_dict_source(self):
+        items = []
+        for field in self.fields:
+            value = _attr_source(field.attr, self.types)
+            if field.json_conv is not None:
+                value = field.json_conv[0].format(value)
+            items.append((field.key, value))
+        entries = ['"type": {0!r}'.format(self.json_type)]
+        entries.extend("{0!r}: {1}".format(key, source) for key, source in self._top_level(items, {}))
+        return "def to_dict(obj):\n    return {{{0}}}\n".format(", ".join(entries))
+
+    def _from_dict_source(self):
+        lines = ["def from_dict(obj, d):", '    assert d["type"] == {0!r}'.format(self.json_type)]
+        for field in self.fields:
+            if getattr(field, "choices", None) is not None:
+                lines.append("    assert {0} in {1!r}".format(_key_source(field.key), field.choices))
+        items = []
+        for field in self.fields:
+            value = _key_source(field.key)
+            if field.json_conv is not None:
+                value = field.json_conv[1].format(value)
+            items.append((field.attr, value))
+        for attr, source in self._top_level(items, self.types):
+            lines.append("    " + self._assign_source(attr, source))
+        return "\n".join(lines) + "\n"
+
+    # Group (path, expression) pairs by their first path element, the top level attribute or key
+    @staticmethod
+    def _top_level(items, types):
+        grouped = {}
+        for path, source in items:
+            grouped.setdefault(path[0], []).append((path[1:], source))
+
+        result = []
+        for name, subitems in grouped.items():
+            if len(subitems) == 1 and subitems[0][0] == ():
+                result.append((name, subitems[0][1]))
+            else:
+                result.append((name, _nested_source(subitems, types, (name, ))))
+        return result